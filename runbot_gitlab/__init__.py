@@ -24,5 +24,6 @@ from . import (
     runbot_repo,
     runbot_branch,
     runbot_build,
+    runbot_gitlab_event,
     controllers,
 )
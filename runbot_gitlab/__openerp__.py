@@ -33,6 +33,27 @@ Add option in repo form view for gitlab repos builds. When checked:
 
 * Runbot will pool the gitlab interface
 
+Gitlab can also notify runbot of merge request and push events by adding a
+webhook pointing to http://RUNBOT_DOMAIN/gitlab-ci/REPO_ID/hook with a secret
+token, checking "Use Gitlab Webhook" on the repo and setting the same token in
+"Webhook Secret Token". Runbot then only looks at what was notified and fully
+polls gitlab every "Full Sync Interval" minutes to catch up on missed events.
+
+Build status changes can be followed by long polling
+/longpolling/gitlab-ci/REPO_ID/statuses?shas=SHA,SHA&refs=BRANCH, which, as
+for the bus module, should be served by the longpolling port in
+multi-process mode.
+
+With "Publish Commit Statuses" checked, runbot posts build statuses to the
+commit status API of gitlab as builds change. Updates of a commit made within
+a few seconds are sent as one.
+
+Wall time, SQL queries and cache lookups of the gitlab-ci routes of each
+worker are exposed in the Prometheus text format on /gitlab-ci/metrics.
+
+benchmarks/bench_gitlab_ci.py load tests those routes against a fake gitlab
+polling runbot, see its docstring for usage.
+
 Contributors
 ------------
 * Sandy Carter (sandy.carter@savoirfairelinux.com)
@@ -43,6 +64,7 @@ Contributors
         'python': ['gitlab3', ]
     },
     'data': [
+        'security/ir.model.access.csv',
         'runbot_repo_view.xml',
     ],
     'installable': True,
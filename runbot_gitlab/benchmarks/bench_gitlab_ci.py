@@ -0,0 +1,208 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Load test of the gitlab-ci routes of runbot_gitlab
+
+Seeds a runbot database through XML-RPC with repos, branches and builds
+matching the projects of a fake gitlab, starts the fake gitlab (which polls
+runbot like gitlab does), then requests repo_view, build_view, builds,
+commits and status_badge from a pool of threads and reports the p50 and p99
+latencies and the throughput of each route.
+
+Runbot must be running with runbot_gitlab installed, ideally with the
+number of workers used in production::
+
+    python bench_gitlab_ci.py --url http://localhost:8069 --db runbot \\
+        --repos 5 --branches 20 --builds 5 --concurrency 16 --duration 60
+
+Seeded repos are created with the "disabled" mode so the runbot cron leaves
+them alone. Pass --repo-ids to reuse repos seeded by a previous run.
+"""
+
+import argparse
+import itertools
+import random
+import threading
+import time
+import urllib
+import xmlrpclib
+
+import fake_gitlab
+from stats import Client, Recorder
+
+
+def seed(url, db, login, password, projects, gitlab_port):
+    """Create a runbot repo for each project of the fake gitlab
+
+    :returns list: ids of the repos, in the order of projects
+    """
+    common = xmlrpclib.ServerProxy('%s/xmlrpc/2/common' % url)
+    uid = common.login(db, login, password)
+    if not uid:
+        raise SystemExit("Could not log in %s as %s" % (db, login))
+    models = xmlrpclib.ServerProxy('%s/xmlrpc/2/object' % url)
+
+    def create(model, vals):
+        return models.execute_kw(db, uid, password, model, 'create', [vals])
+
+    states = itertools.cycle([
+        ('done', 'ok'), ('done', 'ko'), ('running', 'ok'), ('done', 'warn'),
+        ('testing', False),
+    ])
+    repo_ids = []
+    for project in projects:
+        repo_id = create('runbot.repo', {
+            'name': 'http://127.0.0.1:%d/%s' % (
+                gitlab_port, project['path_with_namespace']),
+            'mode': 'disabled',
+            'uses_gitlab': True,
+            'token': 'bench',
+        })
+        repo_ids.append(repo_id)
+        for branch in project['branches']:
+            vals = {'repo_id': repo_id}
+            if branch['merge_request_id']:
+                vals.update({
+                    'name': branch['name'],
+                    'project_id': project['id'],
+                    'merge_request_id': branch['merge_request_iid'],
+                })
+            else:
+                vals.update({
+                    'name': 'refs/heads/%s' % branch['name'],
+                    'sticky': True,
+                })
+            branch_id = create('runbot.branch', vals)
+            for n, sha in enumerate(branch['shas']):
+                last = n == len(branch['shas']) - 1
+                state, result = next(states) if last else ('done', 'ok')
+                create('runbot.build', {
+                    'branch_id': branch_id,
+                    'name': sha,
+                    'author': 'Bench',
+                    'subject': 'Commit %s' % sha[:8],
+                    'state': state,
+                    'result': result,
+                })
+    return repo_ids
+
+
+def requests_of(repo_ids, projects):
+    """List the (endpoint, path) requests made by the load"""
+    paths = []
+    for repo_id, project in zip(repo_ids, projects):
+        prefix = '/gitlab-ci/%d' % repo_id
+        for branch in project['branches']:
+            ref = urllib.urlencode({'ref': branch['name']})
+            paths.append(('repo_view', '%s?%s' % (prefix, ref)))
+            paths.append(('status_badge', '%s/status.png?%s' % (prefix, ref)))
+            for sha in branch['shas']:
+                paths.append(('build_view', '%s/builds/%s' % (prefix, sha)))
+                paths.append(('builds', '%s/builds/%s/status.json' % (
+                    prefix, sha)))
+                paths.append(('commits', '%s/commits/%s/status.json' % (
+                    prefix, sha[:8])))
+    return paths
+
+
+def worker(client, recorder, paths, deadline, remaining):
+    while time.time() < deadline:
+        with remaining['lock']:
+            if remaining['count'] is not None:
+                if remaining['count'] <= 0:
+                    return
+                remaining['count'] -= 1
+        endpoint, path = random.choice(paths)
+        client.timed_get(recorder, endpoint, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:8069',
+                        help="url of runbot")
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--repos', type=int, default=3)
+    parser.add_argument('--branches', type=int, default=10)
+    parser.add_argument('--builds', type=int, default=5)
+    parser.add_argument('--repo-ids',
+                        help="comma separated ids of repos already seeded "
+                             "with the same --repos, --branches and --builds")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30,
+                        help="seconds of load")
+    parser.add_argument('--requests', type=int,
+                        help="stop after this number of requests")
+    parser.add_argument('--gitlab-port', type=int, default=8090)
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help="seconds between two polls of a branch by the "
+                             "fake gitlab, 0 to disable polling")
+    args = parser.parse_args()
+
+    projects = fake_gitlab.dataset(args.repos, args.branches, args.builds)
+    server = fake_gitlab.start(args.gitlab_port, projects)[0]
+    if args.repo_ids:
+        repo_ids = [int(i) for i in args.repo_ids.split(',')]
+    else:
+        repo_ids = seed(args.url, args.db, args.login, args.password,
+                        projects, args.gitlab_port)
+        print "Seeded repos %s" % ','.join(str(i) for i in repo_ids)
+
+    recorder = Recorder()
+    poll_recorder = Recorder()
+    poller = None
+    if args.poll_interval:
+        poller = fake_gitlab.Poller(args.url, repo_ids, projects,
+                                    args.poll_interval, poll_recorder)
+        poller.start()
+
+    client = Client(args.url)
+    paths = requests_of(repo_ids, projects)
+    remaining = {'count': args.requests, 'lock': threading.Lock()}
+    start = time.time()
+    threads = [
+        threading.Thread(target=worker, args=(
+            client, recorder, paths, start + args.duration, remaining))
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if poller:
+        poller.stop()
+
+    print "Load of %d threads" % args.concurrency
+    recorder.report(elapsed)
+    if poller:
+        print
+        print "Polling of the fake gitlab"
+        poll_recorder.report(elapsed)
+    print
+    print "%d commit statuses published to the fake gitlab" % (
+        len(server.statuses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Fake gitlab serving runbot_gitlab and polling it like gitlab does
+
+The server answers the calls of runbot_gitlab to the v3 api of gitlab
+(projects, branches, merge requests, commits, gitlab-ci service and commit
+statuses) from a dataset generated by ``dataset()``, the same one
+``bench_gitlab_ci.py`` seeds runbot with.
+
+Like gitlab, it also polls runbot: each branch page asks for the status of
+its last commit and shows its status badge, every ``--poll-interval``
+seconds. Latencies of the polls are reported when the server is stopped.
+
+Usage::
+
+    python fake_gitlab.py --port 8090 --runbot http://localhost:8069 \\
+        --repo-ids 1,2,3
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from stats import Recorder, Client
+
+NAMESPACE = 'bench'
+UPDATED_AT = '2015-01-01T00:00:00.000Z'
+EPOCH = datetime.datetime(2015, 1, 1)
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+
+def make_sha(*parts):
+    return hashlib.sha1('-'.join(str(p) for p in parts)).hexdigest()
+
+
+def dataset(repos, branches, builds):
+    """Generate the projects of the benchmark
+
+    :param int repos: number of projects
+    :param int branches: number of branches of each project, the first one
+        being the sticky default branch, the others merge requests
+    :param int builds: number of commits built on each branch
+    :returns list: dicts of projects, each with its branches, each with the
+        shas of its commits, oldest first
+    """
+    projects = []
+    for r in range(repos):
+        project = {
+            'id': r + 1,
+            'name': 'repo%d' % r,
+            'path_with_namespace': '%s/repo%d' % (NAMESPACE, r),
+            'default_branch': 'master',
+            'branches': [],
+        }
+        for b in range(branches):
+            project['branches'].append({
+                'name': 'master' if b == 0 else 'feature-%d' % b,
+                'merge_request_id': None if b == 0 else r * branches + b,
+                'merge_request_iid': None if b == 0 else b,
+                'shas': [make_sha(r, b, n) for n in range(builds)],
+            })
+        projects.append(project)
+    return projects
+
+
+class FakeGitlab(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, projects):
+        HTTPServer.__init__(self, address, FakeGitlabHandler)
+        self.projects = projects
+        self.by_id = dict((str(p['id']), p) for p in projects)
+        self.by_id.update(
+            (urllib.quote_plus(p['path_with_namespace']), p)
+            for p in projects
+        )
+        self.statuses = []
+
+
+class FakeGitlabHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer responses so headers and body are sent at once
+    wbufsize = -1
+
+    ROUTES = [
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)$', 'project'),
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)/repository/branches$',
+         'branches'),
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)/repository/branches/'
+                r'(?P<branch>.+)$', 'branch'),
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)/repository/commits/'
+                r'(?P<sha>[0-9a-f]+)$', 'commit'),
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)/merge_requests$',
+         'merge_requests'),
+        ('GET', r'^/api/v3/projects/(?P<project>[^/]+)/merge_requests/'
+                r'(?P<mr>\d+)$', 'merge_request'),
+        ('PUT', r'^/api/v3/projects/(?P<project>[^/]+)/services/gitlab-ci$',
+         'ci_service'),
+        ('POST', r'^/api/v3/projects/(?P<project>[^/]+)/statuses/'
+                 r'(?P<sha>[0-9a-f]+)$', 'commit_status'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        self.query = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else ''
+        for route_method, pattern, name in self.ROUTES:
+            mo = re.match(pattern, url.path)
+            if route_method == method and mo:
+                params = mo.groupdict()
+                project = self.server.by_id.get(params.pop('project'))
+                if project is None:
+                    break
+                status, data = getattr(self, name)(project, **params)
+                return self.reply(status, data)
+        self.reply(404, {'message': '404 Not Found'})
+
+    def reply(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def paginate(self, items):
+        page = max(int(self.query.get('page', 1)), 1)
+        per_page = int(self.query.get('per_page', 20))
+        return items[(page - 1) * per_page:page * per_page]
+
+    def project(self, project):
+        return 200, dict(
+            (k, v) for k, v in project.items() if k != 'branches'
+        )
+
+    def _branch(self, project, branch):
+        return {
+            'name': branch['name'],
+            'protected': branch['merge_request_id'] is None,
+            'commit': {'id': branch['shas'][-1]},
+        }
+
+    def branches(self, project):
+        return 200, self.paginate(
+            [self._branch(project, b) for b in project['branches']]
+        )
+
+    def branch(self, project, branch):
+        name = urllib.unquote(branch)
+        for b in project['branches']:
+            if b['name'] == name:
+                return 200, self._branch(project, b)
+        return 404, {'message': '404 Branch Not Found'}
+
+    def commit(self, project, sha):
+        return 200, {
+            'id': sha,
+            'short_id': sha[:8],
+            'title': 'Commit %s' % sha[:8],
+            'message': 'Commit %s' % sha[:8],
+            'author_name': 'Bench',
+            'author_email': 'bench@example.com',
+            'committer_name': 'Bench',
+            'committer_email': 'bench@example.com',
+            'created_at': UPDATED_AT,
+            'authored_date': UPDATED_AT,
+            'committed_date': UPDATED_AT,
+        }
+
+    def _updated_at(self, branch):
+        # Each merge request was updated a second after the previous one
+        return EPOCH + datetime.timedelta(seconds=branch['merge_request_id'])
+
+    def _merge_request(self, project, branch):
+        return {
+            'id': branch['merge_request_id'],
+            'iid': branch['merge_request_iid'],
+            'project_id': project['id'],
+            'source_project_id': project['id'],
+            'target_project_id': project['id'],
+            'title': branch['name'],
+            'state': 'opened',
+            'source_branch': branch['name'],
+            'target_branch': project['default_branch'],
+            'sha': branch['shas'][-1],
+            'updated_at': self._updated_at(branch).strftime(DATE_FORMAT),
+        }
+
+    def merge_requests(self, project):
+        branches = [b for b in project['branches'] if b['merge_request_id']]
+        state = self.query.get('state', 'all')
+        if state not in ('all', 'opened'):
+            branches = []
+        updated_after = self.query.get('updated_after')
+        if updated_after:
+            # Naive UTC isoformat, with or without microseconds
+            if '.' not in updated_after:
+                updated_after += '.0'
+            updated_after = datetime.datetime.strptime(
+                updated_after, '%Y-%m-%dT%H:%M:%S.%f')
+            branches = [b for b in branches
+                        if self._updated_at(b) >= updated_after]
+        order_by = self.query.get('order_by', 'created_at')
+        branches.sort(
+            key=lambda b: (self._updated_at(b) if order_by == 'updated_at'
+                           else b['merge_request_id']),
+            reverse=self.query.get('sort') != 'asc',
+        )
+        return 200, self.paginate(
+            [self._merge_request(project, b) for b in branches])
+
+    def merge_request(self, project, mr):
+        for b in project['branches']:
+            if b['merge_request_id'] == int(mr):
+                return 200, self._merge_request(project, b)
+        return 404, {'message': '404 Not found'}
+
+    def ci_service(self, project):
+        return 200, {}
+
+    def commit_status(self, project, sha):
+        data = dict(urlparse.parse_qsl(self.body))
+        self.server.statuses.append((time.time(), sha, data.get('state')))
+        return 201, {'sha': sha, 'status': data.get('state')}
+
+
+class Poller(threading.Thread):
+    """Poll runbot for the status of the branches of projects like gitlab
+
+    Each branch page shown by gitlab asks for the status of the last commit
+    of the branch and displays its badge. Polls of the branches are spread
+    over the interval.
+    """
+
+    def __init__(self, runbot_url, repo_ids, projects, interval, recorder):
+        super(Poller, self).__init__(name='gitlab poller')
+        self.daemon = True
+        self.client = Client(runbot_url)
+        self.interval = interval
+        self.recorder = recorder
+        self.stopped = threading.Event()
+        self.pages = []
+        for repo_id, project in zip(repo_ids, projects):
+            for branch in project['branches']:
+                self.pages.append((repo_id, branch['name'],
+                                   branch['shas'][-1]))
+        random.shuffle(self.pages)
+
+    def run(self):
+        delay = self.interval / float(max(len(self.pages), 1))
+        while not self.stopped.is_set():
+            for repo_id, ref, sha in self.pages:
+                if self.stopped.is_set():
+                    return
+                self.client.timed_get(
+                    self.recorder, 'poll status',
+                    '/gitlab-ci/%s/commits/%s/status.json' % (repo_id, sha),
+                )
+                self.client.timed_get(
+                    self.recorder, 'poll badge',
+                    '/gitlab-ci/%s/status.png?%s' % (
+                        repo_id, urllib.urlencode({'ref': ref})
+                    ),
+                )
+                self.stopped.wait(delay)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start(port, projects, runbot_url=None, repo_ids=None, interval=None,
+          recorder=None):
+    """Start the fake gitlab and its poller in daemon threads
+
+    :returns tuple: server and poller, None if not polling
+    """
+    server = FakeGitlab(('127.0.0.1', port), projects)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='fake gitlab')
+    thread.daemon = True
+    thread.start()
+    poller = None
+    if runbot_url and repo_ids and interval:
+        poller = Poller(runbot_url, repo_ids, projects, interval, recorder)
+        poller.start()
+    return server, poller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--repos', type=int, default=3)
+    parser.add_argument('--branches', type=int, default=10)
+    parser.add_argument('--builds', type=int, default=5)
+    parser.add_argument('--runbot', help="url of runbot to poll")
+    parser.add_argument('--repo-ids',
+                        help="comma separated ids of the seeded repos")
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help="seconds between two polls of a branch")
+    args = parser.parse_args()
+    projects = dataset(args.repos, args.branches, args.builds)
+    repo_ids = [int(i) for i in (args.repo_ids or '').split(',') if i]
+    recorder = Recorder()
+    start(args.port, projects, args.runbot, repo_ids, args.poll_interval,
+          recorder)
+    print "Fake gitlab listening on http://127.0.0.1:%d" % args.port
+    start_time = time.time()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    recorder.report(time.time() - start_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Timing of http requests and report of their latencies"""
+
+import httplib
+import threading
+import time
+import urlparse
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Recorder(object):
+    """Thread safe record of request latencies by endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency, error=False):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, elapsed):
+        """Print count, errors, throughput, p50 and p99 of endpoints
+
+        :param float elapsed: seconds during which requests were made
+        """
+        print "%-16s %8s %6s %9s %9s %9s" % (
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms')
+        total = 0
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            total += len(values)
+            print "%-16s %8d %6d %9.1f %9.1f %9.1f" % (
+                endpoint, len(values), self.errors.get(endpoint, 0),
+                len(values) / elapsed,
+                percentile(values, 50) * 1000,
+                percentile(values, 99) * 1000,
+            )
+        print "%d requests in %.1f seconds, %.1f req/s" % (
+            total, elapsed, total / elapsed if elapsed else 0)
+
+
+class Client(object):
+    """Keep-alive http client, one connection per thread
+
+    Redirects are not followed: the latency of a redirect is the one of
+    the route answering it.
+    """
+
+    def __init__(self, url):
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = httplib.HTTPConnection(
+                self.host, self.port, timeout=60
+            )
+        return conn
+
+    def get(self, path):
+        """GET path, returns the status of the response"""
+        conn = self._connection()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (httplib.HTTPException, IOError):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def timed_get(self, recorder, endpoint, path):
+        start = time.time()
+        try:
+            status = self.get(path)
+        except (httplib.HTTPException, IOError):
+            status = None
+        recorder.record(endpoint, time.time() - start,
+                        error=status is None or status >= 500)
+        return status
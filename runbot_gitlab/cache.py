@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+from collections import OrderedDict
+
+# Hits and misses of the lookups made by the current thread on all caches
+lookups = threading.local()
+
+
+def count_lookups():
+    """Return the (hits, misses) of all caches made by the current thread"""
+    return getattr(lookups, 'hits', 0), getattr(lookups, 'misses', 0)
+
+
+class LRUCache(object):
+    """Thread safe mapping keeping the ``size`` most recently used entries
+
+    Entries older than ``ttl`` seconds are dropped when looked up, a ttl of
+    None keeps them until they are evicted or invalidated.
+    """
+
+    def __init__(self, size=1024, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expire = self._data.pop(key)
+            except KeyError:
+                self._miss()
+                return default
+            if expire is not None and expire < time.time():
+                self._miss()
+                return default
+            self._data[key] = (value, expire)
+            self.hits += 1
+            lookups.hits = getattr(lookups, 'hits', 0) + 1
+            return value
+
+    def _miss(self):
+        self.misses += 1
+        lookups.misses = getattr(lookups, 'misses', 0) + 1
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expire = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expire)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, (default, None))[0]
+
+    def invalidate(self, predicate=None):
+        """Drop the entries whose key match predicate, all of them if None
+
+        :param function predicate: called with each key
+        """
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
@@ -20,78 +20,260 @@
 #
 ##############################################################################
 
+import hashlib
+import hmac
 import logging
+import re
+import time
+from collections import OrderedDict
 import simplejson
 import werkzeug
 from werkzeug.wrappers import Response
+from matplotlib.font_manager import FontProperties
+from matplotlib.textpath import TextToPath
 
 from openerp import http, SUPERUSER_ID
 from openerp.http import request
 
+from ..cache import LRUCache
+from ..dispatch import dispatch
+from ..metrics import metrics, release_request_cursor
+from ..runbot_build import (
+    badge_cache,
+    get_cache_generation,
+    get_gitlab_status,
+    ref_cache,
+    status_cache,
+)
+from ..runbot_repo import project_cache, protected_branches_cache
+
 logger = logging.getLogger(__name__)
 
+# Full or abbreviated commit sha
+SHA_RE = re.compile(r'^[0-9a-f]{4,40}$')
+
+# Maximum number of commits of a statuses.json request
+MAX_BATCH_SHAS = 100
+
+# Seconds a status poll waits for changes before answering
+POLL_TIMEOUT = 50
+
+# What polls answer about builds, and the non skipped builds of a repo
+POLL_COLUMNS = """
+       build.id, build.name, branch.branch_name, build.state, build.result,
+       build.write_date"""
+POLL_BUILDS = """
+FROM runbot_build build
+JOIN runbot_branch branch ON branch.id = build.branch_id
+WHERE build.repo_id = %s
+  AND (build.result IS NULL OR build.result != 'skipped')"""
+
+# Cursor of a polling client: the date from which builds may still change,
+# then the status of the builds changed since that date it already knows,
+# e.g. "2015-01-01 00:00:00.123|12:success,13:pending"
+LAST_RE = re.compile(
+    r'^(?P<since>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,6})?)'
+    r'(\|(?P<seen>\d+:[a-z]+(,\d+:[a-z]+)*))?$'
+)
+
+# Seconds clients and proxies may cache responses for
+STATUS_MAX_AGE = 10
+REDIRECT_MAX_AGE = 10
+BADGE_MAX_AGE = {
+    'testing': 300,
+    'success': 600,
+    'warning': 600,
+    'failed': 600,
+}
+
+# from https://github.com/badges/shields/blob/master/colorscheme.json
+BADGE_COLORS = {
+    'testing': "#dfb317",
+    'success': "#4c1",
+    'failed': "#e05d44",
+    'warning': "#fe7d37",
+}
+
+# Rendered svg badges by (branch name, badge state)
+svg_cache = LRUCache(size=1024)
+
+metrics.register_cache('badge', badge_cache)
+metrics.register_cache('project', project_cache)
+metrics.register_cache('protected_branches', protected_branches_cache)
+metrics.register_cache('ref', ref_cache)
+metrics.register_cache('status', status_cache)
+metrics.register_cache('svg', svg_cache)
+
+
+def text_width(text):
+    """Width of text in runbot's badge font"""
+    font = FontProperties(family='DejaVu Sans', size=11)
+    width, _, _ = TextToPath().get_text_width_height_descent(
+        text, font, False
+    )
+    return int(width + 1)
+
+
+class BadgeText(object):
+    """Part of a badge, as expected by runbot's badge templates"""
+    __slots__ = ['text', 'color', 'width']
+
+    def __init__(self, text, color):
+        self.text = text
+        self.color = color
+        self.width = text_width(text) + 10
+
+
+def parse_last(last):
+    """Parse the cursor of a polling client
+
+    :param str or None last: cursor answered by the previous poll
+    :returns tuple: date from which builds may still change, None for the
+        first poll, and dict of the statuses known by build id
+    """
+    mo = LAST_RE.match(last or '')
+    if not mo:
+        return None, {}
+    seen = {}
+    for item in (mo.group('seen') or '').split(','):
+        if item:
+            build_id, status = item.split(':')
+            seen[int(build_id)] = status
+    return mo.group('since'), seen
+
+
+def format_last(since, seen):
+    """Format the cursor answered to a polling client, see parse_last"""
+    if not seen:
+        return since
+    return '%s|%s' % (since, ','.join(
+        '%d:%s' % (build_id, seen[build_id]) for build_id in sorted(seen)
+    ))
+
+
+def status_etag(status, build=None):
+    """Entity tag of a commit status given by its last build
+
+    :param str status: gitlab status of the commit
+    :param dict build: id and write_date of the build, None if not built
+    """
+    if build is None:
+        value = status
+    else:
+        value = '%d-%s-%s' % (build['id'], build['write_date'], status)
+    return hashlib.md5(value).hexdigest()
+
 
 class GitlabCIController(http.Controller):
     CONTROLLER_PREFIX = '/gitlab-ci/<repo_id>'
 
     @http.route(CONTROLLER_PREFIX, type="http", auth="public")
+    @metrics.timed
     def repo_view(self, repo_id, ref=None):
         """Redirect to runbot page related to current repo"""
         try:
-            registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
-
-            branch_id = registry['runbot.branch'].search(
-                cr, uid, [('branch_name', '=', ref)]
-            )[0]
-            build_id = registry['runbot.build'].search(
-                cr, uid, [
-                    ('branch_id', '=', branch_id),
-                    ('result', '!=', 'skipped'),
-                ], limit=1, order='job_start desc',
-            )[0]
-        except IndexError:
-            return werkzeug.utils.redirect('/runbot/repo/%s' % repo_id)
-        else:
-            return werkzeug.utils.redirect('/runbot/build/%d' % build_id)
+            repo_id = int(repo_id)
+        except ValueError:
+            return self._redirect('/runbot/repo/%s' % repo_id)
+        build_id = ref_cache.get((repo_id, ref))
+        if build_id is None:
+            generation = self._cache_generation(repo_id)
+            build_id = self._find_branch_build(repo_id, ref)
+            if generation == self._cache_generation(repo_id):
+                ref_cache.set((repo_id, ref), build_id)
+        if not build_id:
+            return self._redirect('/runbot/repo/%s' % repo_id)
+        return self._redirect('/runbot/build/%d' % build_id)
+
+    def _find_branch_build(self, repo_id, ref):
+        """Find the last non skipped build of a branch of a repo
+
+        Served by the runbot_branch_repo_branch_name_index index.
+
+        :param int repo_id: id of the runbot.repo
+        :param str ref: name of the branch
+        :returns int: id of the build, 0 if not found
+        """
+        request.cr.execute("""
+SELECT build.id
+FROM runbot_build build
+JOIN runbot_branch branch ON branch.id = build.branch_id
+WHERE branch.repo_id = %s
+  AND branch.branch_name = %s
+  AND (build.result IS NULL OR build.result != 'skipped')
+ORDER BY build.job_start DESC
+LIMIT 1""", (repo_id, ref))
+        row = request.cr.fetchone()
+        return row[0] if row else 0
 
     @http.route(CONTROLLER_PREFIX + "/build", type="json", auth="public")
+    @metrics.timed
     def build(self, repo_id, token=None):
         """Call to start build for regular push"""
         logger.info("build with token %s" % token)
         return {}
 
+    @http.route(CONTROLLER_PREFIX + "/hook",
+                type="http", auth="public", methods=['POST'])
+    @metrics.timed
+    def hook(self, repo_id, **kwargs):
+        """Queue merge request and push events sent by a gitlab webhook
+
+        POST /gitlab-ci/REPO_ID/hook
+        """
+        registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
+        try:
+            repo = registry['runbot.repo'].browse(cr, uid, int(repo_id))
+        except ValueError:
+            return request.not_found()
+        if not (repo.exists() and repo.uses_gitlab and
+                repo.gitlab_use_webhook):
+            return request.not_found()
+        token = request.httprequest.headers.get('X-Gitlab-Token') or ''
+        if (not repo.gitlab_webhook_token or
+                not hmac.compare_digest(str(token),
+                                        str(repo.gitlab_webhook_token))):
+            logger.warning("Invalid webhook token for repo %s", repo.name)
+            return Response(status=403)
+        try:
+            payload = simplejson.loads(request.httprequest.get_data())
+        except ValueError:
+            return Response(status=400)
+        registry['runbot.gitlab.event'].create_from_hook(
+            cr, uid, repo.id, payload
+        )
+        return Response(simplejson.dumps({}), mimetype='application/json')
+
     @http.route(CONTROLLER_PREFIX + "/commits/<sha>",
                 type="http", auth="public")
+    @metrics.timed
     def commit_view(self, repo_id, sha):
         """Link to build page by sha (newer versions of gitlab)
 
         GET /gitlab-ci/1/commits/SHA
         """
-        return self.build_view(repo_id, sha)
+        return self._build_view(repo_id, sha)
 
     @http.route(CONTROLLER_PREFIX + "/builds/<sha>",
                 type="http", auth="public")
+    @metrics.timed
     def build_view(self, repo_id, sha):
         """Link to build page by sha (older versions of gitlab)
 
         GET /gitlab-ci/1/builds/SHA
         """
-        try:
-            registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
-            build_id = registry['runbot.build'].search(
-                cr, uid, [
-                    ('name', 'like', sha + '%'),
-                    ('result', '!=', 'skipped'),
-                ],
-                limit=1, order='job_start desc'
-            )[0]
-        except (IndexError, KeyError):
-            return werkzeug.utils.redirect('/runbot/repo/%s' % repo_id)
-        else:
-            return werkzeug.utils.redirect('/runbot/build/%d' % build_id)
+        return self._build_view(repo_id, sha)
+
+    def _build_view(self, repo_id, sha):
+        """Redirect to the build page of a sha"""
+        build = self._find_build(repo_id, sha)
+        if not build:
+            return self._redirect('/runbot/repo/%s' % repo_id)
+        return self._redirect('/runbot/build/%d' % build['id'])
 
     @http.route(CONTROLLER_PREFIX + "/commits/<sha>/status.json",
                 type="http", auth="public")
+    @metrics.timed
     def commits(self, repo_id, sha, token=None):
         """Call on merge request open/close (newer versions of gitlab)
 
@@ -103,10 +285,11 @@ class GitlabCIController(http.Controller):
         Runbot get:
         GET /gitlab/REPO_ID/commits/GIT_SHA1/status.json
         """
-        return self.builds(repo_id, sha, token=token)
+        return self._builds(repo_id, sha, token=token)
 
     @http.route(CONTROLLER_PREFIX + "/builds/<sha>/status.json",
                 type="http", auth="public")
+    @metrics.timed
     def builds(self, repo_id, sha, token=None):
         """Call on merge request open/close (older versions of gitlab)
 
@@ -114,61 +297,390 @@ class GitlabCIController(http.Controller):
 
         GET /gitlab/REPO_ID/builds/GIT_SHA1/status.json
         """
-        res = None
+        return self._builds(repo_id, sha, token=token)
+
+    def _builds(self, repo_id, sha, token=None):
+        """Answer the testing status of a sha"""
+        status, etag = 'unknown', None
         try:
             logger.debug("build with token %s" % token)
             logger.debug("I want the status of commit %s" % sha)
-            registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
-            status = 'unknown'
-            try:
-                build_id = registry['runbot.build'].search(
-                    cr, uid, [
-                        ('name', 'like', sha + '%'),
-                        ('result', '!=', 'skipped'),
-                    ], limit=1, order='job_start desc'
-                )[0]
-                build = registry['runbot.build'].browse(cr, uid, build_id)
-                result = build.result
-                state = build.state
-                logger.debug("Build status of commit %s is %s" % (sha, state))
-                logger.debug("Build result of commit %s is %s" % (sha, result))
-                if result == 'ko':
-                    status = 'failed'
-                elif state == 'pending':
-                    status = 'pending'
-                elif state == 'testing':
-                    status = 'pending'
-                elif state == 'running':
-                    status = 'running'
-                elif result in ['ok', 'warn']:
-                    status = 'success'
-                else:
-                    status = 'unknown'
-            except IndexError:
-                logger.debug("No good builds found for commit %s" % sha)
-                status = 'failed'
-            finally:
+            key = (repo_id, sha.lower())
+            cached = status_cache.get(key)
+            if cached is None:
+                generation = self._cache_generation(repo_id)
+                cached = self._get_status(repo_id, sha)
+                if generation == self._cache_generation(repo_id):
+                    status_cache.set(key, cached)
+            status, etag = cached
+        finally:
+            def make_response():
                 res = {
                     'id': repo_id,
                     'sha': sha,
                     'status': status,
                 }
-        finally:
-            res = simplejson.dumps(res)
-            return Response(res, mimetype='application/json')
+                res = simplejson.dumps(res)
+                return Response(res, mimetype='application/json')
+            if etag is None:
+                return make_response()
+            return self._conditional(etag, make_response, STATUS_MAX_AGE)
+
+    def _cache_generation(self, repo_id):
+        """Get the generation of the caches of a repo, listening to the
+        notifications invalidating them"""
+        dispatch.listen(request.db)
+        return get_cache_generation(repo_id)
+
+    def _find_build(self, repo_id, sha, fields=None):
+        """Find the last non skipped build of a commit in a repo
+
+        The prefix search on the sha is served by the
+        runbot_build_repo_name_prefix_index index.
+
+        :param str repo_id: id of the runbot.repo
+        :param str sha: full or abbreviated sha of the commit
+        :param list fields: fields to read from the build, besides id
+        :returns dict or None: values of the build
+        """
+        sha = sha.lower()
+        if not SHA_RE.match(sha):
+            return None
+        try:
+            repo_id = int(repo_id)
+        except ValueError:
+            return None
+        registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
+        builds = registry['runbot.build'].search_read(
+            cr, uid, [
+                ('repo_id', '=', repo_id),
+                ('name', '=like', sha + '%'),
+                ('result', '!=', 'skipped'),
+            ], fields or ['id'], limit=1, order='job_start desc'
+        )
+        return builds and builds[0] or None
+
+    def _get_status(self, repo_id, sha):
+        """Get gitlab status of the last build of a commit and its etag"""
+        build = self._find_build(
+            repo_id, sha, ['state', 'result', 'write_date']
+        )
+        if not build:
+            logger.debug("No good builds found for commit %s" % sha)
+            return 'failed', status_etag('failed')
+        logger.debug("Build status of commit %s is %s" % (sha, build['state']))
+        logger.debug("Build result of commit %s is %s" %
+                     (sha, build['result']))
+        status = get_gitlab_status(build['state'], build['result'])
+        return status, status_etag(status, build)
+
+    def _conditional(self, etag, make_response, max_age):
+        """Answer 304 when the client already has the etag
+
+        :param str etag: entity tag of the response
+        :param function make_response: called to build the full response
+        :param int max_age: seconds the response may be cached for
+        """
+        if request.httprequest.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = make_response()
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=%d' % max_age
+        return response
+
+    def _redirect(self, location, max_age=REDIRECT_MAX_AGE):
+        """Redirect to location, tagged by location"""
+        return self._conditional(
+            hashlib.md5(location.encode('utf-8')).hexdigest(),
+            lambda: werkzeug.utils.redirect(location),
+            max_age,
+        )
+
+    @http.route(CONTROLLER_PREFIX + "/statuses.json",
+                type="http", auth="public")
+    @metrics.timed
+    def statuses(self, repo_id, shas='', token=None):
+        """Get testing status of several commits at once
+
+        GET /gitlab-ci/REPO_ID/statuses.json?shas=GIT_SHA1,GIT_SHA1
+        """
+        shas = [sha.strip().lower() for sha in shas.split(',') if sha.strip()]
+        shas = list(OrderedDict.fromkeys(shas))[:MAX_BATCH_SHAS]
+        statuses = {}
+        for sha in shas:
+            cached = status_cache.get((repo_id, sha))
+            if cached is not None:
+                statuses[sha] = cached[0]
+        missing = [sha for sha in shas if sha not in statuses]
+        if missing:
+            generation = self._cache_generation(repo_id)
+            found = self._get_statuses(repo_id, missing)
+            current = generation == self._cache_generation(repo_id)
+            for sha in missing:
+                cached = found.get(sha) or ('failed', status_etag('failed'))
+                statuses[sha] = cached[0]
+                if current:
+                    status_cache.set((repo_id, sha), cached)
+        res = simplejson.dumps({
+            'id': repo_id,
+            'statuses': [
+                {'sha': sha, 'status': statuses[sha]} for sha in shas
+            ],
+        })
+        return Response(res, mimetype='application/json')
+
+    def _get_statuses(self, repo_id, shas):
+        """Get gitlab status of the last builds of commits with one query
+
+        :param str repo_id: id of the runbot.repo
+        :param list shas: full or abbreviated shas of the commits
+        :returns dict: gitlab status and etag by sha, commits without builds
+            are left out
+        """
+        shas = [sha for sha in shas if SHA_RE.match(sha)]
+        try:
+            repo_id = int(repo_id)
+        except ValueError:
+            return {}
+        if not shas:
+            return {}
+        registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
+        commits_domain = ['|'] * (len(shas) - 1) + [
+            ('name', '=like', sha + '%') for sha in shas
+        ]
+        builds = registry['runbot.build'].search_read(
+            cr, uid, [
+                ('repo_id', '=', repo_id),
+                ('result', '!=', 'skipped'),
+            ] + commits_domain,
+            ['name', 'state', 'result', 'write_date'],
+            order='job_start desc'
+        )
+        res = {}
+        for build in builds:
+            for sha in shas:
+                if sha not in res and build['name'].startswith(sha):
+                    status = get_gitlab_status(build['state'], build['result'])
+                    res[sha] = (status, status_etag(status, build))
+        return res
+
+    @http.route("/longpolling" + CONTROLLER_PREFIX + "/statuses",
+                type="http", auth="public")
+    @metrics.timed
+    def poll_statuses(self, repo_id, shas='', refs='', last=None):
+        """Wait for status changes of commits or branches
+
+        Answers as soon as a build of the commits or branches changed after
+        ``last``, or after POLL_TIMEOUT seconds without changes. Clients
+        pass the ``last`` of the previous answer to their next request, the
+        first request answers the status of the last build of each commit
+        and branch. Requests without valid commit nor branch are refused.
+
+        GET /longpolling/gitlab-ci/REPO_ID/statuses?shas=SHA&refs=BRANCH&last=
+        """
+        try:
+            repo_id = int(repo_id)
+        except ValueError:
+            return request.not_found()
+        shas = [sha.strip().lower() for sha in shas.split(',')
+                if SHA_RE.match(sha.strip().lower())][:MAX_BATCH_SHAS]
+        refs = [ref.strip() for ref in refs.split(',')
+                if ref.strip()][:MAX_BATCH_SHAS]
+        if not shas and not refs:
+            return Response(status=400)
+        if last and not LAST_RE.match(last):
+            last = None
+        # Don't keep a connection of the pool in a transaction while
+        # waiting, _get_changes uses its own cursors
+        release_request_cursor()
+        deadline = time.time() + POLL_TIMEOUT
+        while True:
+            changes, last = self._get_changes(repo_id, shas, refs, last)
+            remaining = deadline - time.time()
+            if changes or remaining <= 0:
+                break
+            dispatch.wait(request.db, repo_id, remaining)
+        res = simplejson.dumps({
+            'id': repo_id,
+            'last': last,
+            'statuses': changes,
+        })
+        return Response(res, mimetype='application/json')
+
+    def _get_changes(self, repo_id, shas, refs, last):
+        """Get statuses of the builds of commits or branches changed since
+        the cursor last
+
+        The write date of a build is the start of the transaction writing
+        it, which may be committed long after. Builds are therefore read
+        from the start of the oldest transaction running when the previous
+        poll read them, and the statuses already answered since then are
+        filtered out.
+
+        A new cursor is used for each call, the one of the request would
+        keep seeing the database as it was when the request started.
+
+        :param int repo_id: id of the runbot.repo
+        :param list shas: full or abbreviated shas of the commits
+        :param list refs: names of the branches
+        :param str or None last: cursor answered by the previous poll, None
+            to get the current statuses
+        :returns tuple: list of statuses and the cursor of the next poll
+        """
+        if not shas and not refs:
+            return [], last
+        since, seen = parse_last(last)
+        if since:
+            query = "SELECT" + POLL_COLUMNS + POLL_BUILDS + """
+  AND (build.name LIKE ANY(%s) OR branch.branch_name = ANY(%s))
+  AND build.write_date >= %s
+ORDER BY build.write_date"""
+            params = [repo_id, [sha + '%' for sha in shas] or [''],
+                      refs or [''], since]
+        else:
+            # Current statuses: the last build of each commit, one query
+            # by prefix to use the index of commits, and of each branch
+            subqueries, params = [], []
+            for sha in shas:
+                subqueries.append("(SELECT" + POLL_COLUMNS + POLL_BUILDS + """
+  AND build.name LIKE %s
+ORDER BY build.id DESC
+LIMIT 1)""")
+                params += [repo_id, sha + '%']
+            if refs:
+                subqueries.append(
+                    "(SELECT DISTINCT ON (build.branch_id)" + POLL_COLUMNS +
+                    POLL_BUILDS + """
+  AND branch.branch_name = ANY(%s)
+ORDER BY build.branch_id, build.id DESC
+LIMIT %s)""")
+                params += [repo_id, refs, MAX_BATCH_SHAS]
+            query = ("SELECT * FROM (" + " UNION ".join(subqueries) +
+                     ") build ORDER BY write_date")
+        with request.registry.cursor() as cr:
+            # Transactions not committed yet started after the oldest one
+            # running now, builds they write are read by the next poll
+            cr.execute("""
+SELECT LEAST(now(), MIN(xact_start)) AT TIME ZONE 'UTC'
+FROM pg_stat_activity
+WHERE datname = current_database() AND pid != pg_backend_pid()""")
+            next_since = cr.fetchone()[0]
+            cr.execute(query, params)
+            rows = cr.fetchall()
+        changes = OrderedDict()
+        next_seen = {}
+        for build_id, name, ref, state, result, write_date in rows:
+            status = get_gitlab_status(state, result)
+            if str(write_date) >= str(next_since):
+                next_seen[build_id] = status
+            # Statuses already answered are read again until no running
+            # transaction can change them anymore, only answer them once
+            if seen.get(build_id) == status:
+                continue
+            changes[build_id] = {
+                'build_id': build_id,
+                'sha': name,
+                'ref': ref,
+                'status': status,
+            }
+        return changes.values(), format_last(str(next_since), next_seen)
 
     @http.route(CONTROLLER_PREFIX + "/status.png", type="http", auth="public")
+    @metrics.timed
     def status_badge(self, repo_id, ref):
-        """Redirect gitlab's request for a png to runbot's svg
+        """Answer gitlab's request for a png with runbot's svg badge
+
+        The badge is the one of /runbot/badge/REPO_ID/BRANCH_NAME.svg,
+        rendered here to spare gitlab a redirect.
 
         GET /gitlab/REPO_ID/status.png?ref=BRANCH_NAME
         """
         logger.info("I want the status badge for branch %s" % ref)
-        return werkzeug.utils.redirect(
-            '/runbot/badge/%s/%s.svg' % (repo_id, ref)
+        try:
+            repo_id = int(repo_id)
+        except ValueError:
+            return request.not_found()
+        cached = badge_cache.get((repo_id, ref))
+        if cached is None:
+            generation = self._cache_generation(repo_id)
+            state = self._get_badge_state(repo_id, ref)
+            if state is None:
+                return request.not_found()
+            svg = svg_cache.get((ref, state))
+            if svg is None:
+                svg = self._render_badge(ref, state)
+                svg_cache.set((ref, state), svg)
+            cached = (state, svg, hashlib.md5(svg).hexdigest())
+            if generation == self._cache_generation(repo_id):
+                badge_cache.set((repo_id, ref), cached)
+        state, svg, etag = cached
+        return self._conditional(
+            etag,
+            lambda: Response(svg, mimetype='image/svg+xml'),
+            BADGE_MAX_AGE[state],
+        )
+
+    def _get_badge_state(self, repo_id, ref):
+        """Get badge state of the last build of a sticky branch
+
+        :param int repo_id: id of the runbot.repo
+        :param str ref: name of the branch
+        :returns str or None: testing, success, warning or failed, None when
+            the branch has no build
+        """
+        request.cr.execute("""
+SELECT build.state, build.result
+FROM runbot_build build
+JOIN runbot_branch branch ON branch.id = build.branch_id
+WHERE branch.repo_id = %s
+  AND branch.branch_name = %s
+  AND branch.sticky
+  AND build.state IN ('testing', 'running', 'done')
+  AND (build.result IS NULL
+       OR build.result NOT IN ('skipped', 'manually_killed'))
+ORDER BY build.id DESC
+LIMIT 1""", (repo_id, ref))
+        row = request.cr.fetchone()
+        if not row:
+            return None
+        state, result = row
+        if state == 'testing':
+            return 'testing'
+        elif result == 'ok':
+            return 'success'
+        elif result == 'warn':
+            return 'warning'
+        return 'failed'
+
+    def _render_badge(self, ref, state):
+        """Render runbot's default svg badge"""
+        registry, cr, uid = request.registry, request.cr, SUPERUSER_ID
+        svg = registry['ir.ui.view'].render(
+            cr, uid, 'runbot.badge_default', {
+                'left': BadgeText(ref, '#555'),
+                'right': BadgeText(state, BADGE_COLORS[state]),
+            }
+        )
+        if isinstance(svg, unicode):
+            svg = svg.encode('utf-8')
+        return svg
+
+    @http.route("/gitlab-ci/metrics", type="http", auth="public")
+    def metrics_view(self):
+        """Metrics of this worker in the Prometheus text format
+
+        GET /gitlab-ci/metrics
+        """
+        return Response(
+            metrics.render(),
+            mimetype='text/plain',
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+            headers=[('Cache-Control', 'no-cache')],
         )
 
     @http.route("/<namespace>/<repo>/services/gitlab_ci/edit",
                 type="json", auth="public")
+    @metrics.timed
     def edit(self, namespace, repo):
         logger.exception("Edit for %s/%s" % (namespace, repo))
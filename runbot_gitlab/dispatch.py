@@ -0,0 +1,145 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Wake up requests waiting for build status changes
+
+runbot.build changes of state or result are notified with the ids of their
+repos on the STATUS_CHANNEL postgres channel. Each worker starts a thread
+per database listening to it, the same way the bus module does, which
+wakes up the requests waiting on the notified repos and calls the
+subscribed callbacks, e.g. to invalidate caches.
+"""
+
+import logging
+import select
+import threading
+import time
+
+import simplejson
+
+from openerp import sql_db
+
+logger = logging.getLogger(__name__)
+
+STATUS_CHANNEL = 'runbot_gitlab_build'
+
+# Seconds between two checks of the listening connection
+TIMEOUT = 50
+
+
+class StatusDispatch(object):
+    """Let requests wait for build changes notified on STATUS_CHANNEL"""
+
+    def __init__(self):
+        self._waiters = {}
+        self._threads = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call callback with the database and the set of repo ids of each
+        notification, or None for all repos when notifications may have
+        been missed
+        """
+        self._subscribers.append(callback)
+
+    def listen(self, dbname):
+        """Make sure notifications of a database are listened to"""
+        with self._lock:
+            self._start(dbname)
+
+    def wait(self, dbname, repo_id, timeout):
+        """Block until a build of a repo changes
+
+        :param str dbname: database of the repo
+        :param int repo_id: id of the runbot.repo
+        :param float timeout: maximum number of seconds to wait
+        :returns bool: whether a change was notified
+        """
+        key = (dbname, repo_id)
+        event = threading.Event()
+        with self._lock:
+            self._start(dbname)
+            self._waiters.setdefault(key, set()).add(event)
+        try:
+            return event.wait(timeout)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key, set())
+                waiters.discard(event)
+                if not waiters:
+                    self._waiters.pop(key, None)
+
+    def _start(self, dbname):
+        thread = self._threads.get(dbname)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(
+                target=self._run, args=(dbname,),
+                name='%s.StatusDispatch' % __name__,
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads[dbname] = thread
+
+    def _run(self, dbname):
+        while True:
+            try:
+                self._loop(dbname)
+            except Exception:
+                logger.exception("Status dispatch of %s failed", dbname)
+                time.sleep(TIMEOUT)
+
+    def _loop(self, dbname):
+        logger.info("listen %s on db %s", STATUS_CHANNEL, dbname)
+        with sql_db.db_connect(dbname).cursor() as cr:
+            conn = cr._cnx
+            cr.execute("LISTEN " + STATUS_CHANNEL)
+            cr.commit()
+            # Changes may have been missed while not listening
+            self._notify(dbname, None)
+            while True:
+                if select.select([conn], [], [], TIMEOUT) == ([], [], []):
+                    continue
+                conn.poll()
+                repo_ids = set()
+                while conn.notifies:
+                    repo_ids.update(
+                        simplejson.loads(conn.notifies.pop().payload)
+                    )
+                self._wake(dbname, repo_ids)
+                self._notify(dbname, repo_ids)
+
+    def _notify(self, dbname, repo_ids):
+        for callback in self._subscribers:
+            try:
+                callback(dbname, repo_ids)
+            except Exception:
+                logger.exception("Status dispatch callback failed")
+
+    def _wake(self, dbname, repo_ids):
+        with self._lock:
+            for repo_id in repo_ids:
+                for event in self._waiters.get((dbname, repo_id), ()):
+                    event.set()
+
+
+dispatch = StatusDispatch()
@@ -0,0 +1,98 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Process wide pool of gitlab clients
+
+gitlab3 sends every request through the module level functions of requests,
+opening a new connection each time. The pool makes it use a shared session
+instead so connections to gitlab are kept alive between calls and between
+runbot updates.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    import gitlab3
+    from gitlab3 import GitLab
+except ImportError as exc:
+    # don't fail at load if gitlab module is not available
+    gitlab3 = None
+
+# Maximum number of kept alive connections per gitlab host
+POOL_MAXSIZE = 16
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class SessionRequests(object):
+    """Stand-in for the requests module sending through a session"""
+
+    exceptions = requests.exceptions
+
+    def __init__(self, session):
+        self.session = session
+        self.get = session.get
+        self.head = session.head
+        self.post = session.post
+        self.put = session.put
+        self.delete = session.delete
+
+
+def make_session():
+    """Create a requests session keeping connections to gitlab alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE,
+                          pool_maxsize=POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = make_session()
+if gitlab3 is not None:
+    gitlab3.requests = SessionRequests(session)
+
+
+def get_gitlab_client(domain, token):
+    """Get the pooled gitlab client for a domain and token
+
+    gitlab3 keeps the url and token of the last created client on a class
+    shared by all its objects, so they are set back to the ones of the
+    returned client each time it is taken from the pool.
+
+    :param str domain: scheme and host of the gitlab instance
+    :param str token: gitlab user's token
+    :returns gitlab3.GitLab: client for domain using token
+    """
+    key = (domain, token)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = GitLab(domain, token)
+        else:
+            api_cls = gitlab3._GitLabAPI
+            api_cls._base_url = domain.rstrip('/') + "/api/v3"
+            api_cls._headers = {'PRIVATE-TOKEN': token}
+    return client
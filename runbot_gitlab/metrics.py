@@ -0,0 +1,199 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""In-process metrics of the gitlab-ci routes
+
+Each route of the gitlab-ci controller records in histograms its wall time,
+the number of queries it ran on the request cursor and the number of cache
+lookups it hit and missed. Those and the counters of the registered caches
+are exposed in the Prometheus text format.
+
+Metrics are kept per process: with several workers, each one answers with
+its own figures.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+from openerp.http import request
+
+from .cache import count_lookups
+
+# Upper bounds of the buckets of the histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+LOOKUP_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Name, description and buckets of the histograms kept for each route
+ROUTE_HISTOGRAMS = (
+    ('runbot_gitlab_request_duration_seconds',
+     'Wall time of gitlab-ci routes', DURATION_BUCKETS),
+    ('runbot_gitlab_request_queries',
+     'SQL queries run on the request cursor by gitlab-ci routes',
+     QUERY_BUCKETS),
+    ('runbot_gitlab_request_cache_hits',
+     'Cache lookups of gitlab-ci routes which hit', LOOKUP_BUCKETS),
+    ('runbot_gitlab_request_cache_misses',
+     'Cache lookups of gitlab-ci routes which missed', LOOKUP_BUCKETS),
+)
+
+
+class Histogram(object):
+    """Thread safe cumulative histogram"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        """Yield the (upper bound, cumulative count) of each bucket"""
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """Histograms of routes and counters of caches"""
+
+    def __init__(self):
+        # Histograms by metric name and route
+        self.histograms = dict((name, {}) for name, _, _ in ROUTE_HISTOGRAMS)
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def register_cache(self, name, cache):
+        """Expose the hit and miss counters of an LRUCache"""
+        self.caches[name] = cache
+
+    def observe(self, route, values):
+        """Record the values of a call of a route
+
+        :param str route: name of the route
+        :param tuple values: one value for each of ROUTE_HISTOGRAMS
+        """
+        for (name, _, buckets), value in zip(ROUTE_HISTOGRAMS, values):
+            histograms = self.histograms[name]
+            histogram = histograms.get(route)
+            if histogram is None:
+                with self._lock:
+                    histogram = histograms.setdefault(
+                        route, Histogram(buckets)
+                    )
+            histogram.observe(value)
+
+    def timed(self, func):
+        """Decorate a route to record its wall time, query count and cache
+        lookups"""
+        route = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            queries = sql_count()
+            hits, misses = count_lookups()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_hits, end_misses = count_lookups()
+                self.observe(route, (
+                    time.time() - start,
+                    sql_count() - queries,
+                    end_hits - hits,
+                    end_misses - misses,
+                ))
+        return wrapper
+
+    def render(self):
+        """Render the metrics in the Prometheus text format"""
+        lines = []
+        for name, description, _ in ROUTE_HISTOGRAMS:
+            self._render_histograms(
+                lines, name, description, self.histograms[name]
+            )
+        for metric, description, kind, value in (
+            ('runbot_gitlab_cache_hits_total',
+             'Lookups of runbot_gitlab caches which hit', 'counter',
+             lambda cache: cache.hits),
+            ('runbot_gitlab_cache_misses_total',
+             'Lookups of runbot_gitlab caches which missed', 'counter',
+             lambda cache: cache.misses),
+            ('runbot_gitlab_cache_entries',
+             'Entries of runbot_gitlab caches', 'gauge', len),
+        ):
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for name in sorted(self.caches):
+                lines.append('%s{cache="%s"} %d' % (
+                    metric, name, value(self.caches[name]),
+                ))
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, lines, metric, description, histograms):
+        lines.append('# HELP %s %s' % (metric, description))
+        lines.append('# TYPE %s histogram' % metric)
+        for route in sorted(histograms):
+            histogram = histograms[route]
+            for bound, count in histogram.samples():
+                lines.append('%s_bucket{route="%s",le="%s"} %d' % (
+                    metric, route, bound, count,
+                ))
+            lines.append('%s_sum{route="%s"} %s' % (
+                metric, route, repr(float(histogram.sum)),
+            ))
+            lines.append('%s_count{route="%s"} %d' % (
+                metric, route, histogram.count,
+            ))
+
+
+def sql_count():
+    """Number of queries run so far on the cursors of the current request"""
+    cr = getattr(request, '_cr', None)
+    count = getattr(request, 'released_sql_count', 0)
+    return count + (getattr(cr, 'sql_log_count', 0) if cr else 0)
+
+
+def release_request_cursor():
+    """Close the cursor of the current request, keeping the queries it ran
+    in the query count of the request"""
+    cr = request._cr
+    if cr:
+        request.released_sql_count = sql_count()
+        cr.close()
+        request._cr = None
+
+
+metrics = Metrics()
@@ -0,0 +1,162 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""Background queue of http requests sent to gitlab
+
+Requests are sent from a daemon thread through a pooled session so a slow
+or unreachable gitlab doesn't hold the transaction which queued them.
+Failing requests are retried with an exponential back-off. Requests queued
+with a key replace the pending request of the same key, so only the last
+of a burst of updates is sent.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+
+from .gitlab_client import make_session
+
+logger = logging.getLogger(__name__)
+
+# Connect and read timeouts of queued requests, in seconds
+TIMEOUT = (5, 30)
+# Number of times a request is sent before giving up
+MAX_TRIES = 5
+# Seconds before the first retry of a request, doubled on each retry
+RETRY_DELAY = 2
+
+
+class OutboundQueue(object):
+    """Send http requests from a daemon thread, retrying failed ones"""
+
+    def __init__(self, name):
+        self.name = name
+        self.session = make_session()
+        self._heap = []
+        # Last queued job of keyed requests not sent yet, by key
+        self._pending = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def put(self, method, url, delay=0, key=None, callback=None,
+            **kwargs):
+        """Queue a request
+
+        :param str method: http method of the request
+        :param str url: url of the request
+        :param float delay: seconds to wait before sending the request
+        :param key: hashable coalescing key, a pending request of the same
+            key is replaced by this one and sent when it was due
+        :param function callback: called from the queue thread with the
+            response of the request, or None when giving up on it. Not
+            called when the request is replaced by one of the same key.
+        :param kwargs: arguments of requests.Session.request
+        """
+        kwargs.setdefault('timeout', TIMEOUT)
+        self._schedule(
+            time.time() + delay, (method, url, kwargs, 1, callback), key
+        )
+
+    def _schedule(self, due, job, key=None):
+        with self._cond:
+            if key is not None:
+                pending = key in self._pending
+                self._pending[key] = job
+                if pending:
+                    return
+            heapq.heappush(self._heap, (due, next(self._seq), key, job))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='%s queue' % self.name
+                )
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _next(self):
+        """Wait for the next request due to be sent"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.time()
+                if wait <= 0:
+                    _, _, key, job = heapq.heappop(self._heap)
+                    if key is not None:
+                        job = self._pending.pop(key)
+                    return key, job
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            key, job = self._next()
+            try:
+                self._send(job, key)
+            except Exception:
+                logger.exception("%s: could not send %s %s",
+                                 self.name, job[0], job[1])
+
+    def _send(self, job, key=None):
+        method, url, kwargs, tries, callback = job
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as exc:
+            error = exc
+        else:
+            if response.status_code < 500:
+                if response.status_code >= 400:
+                    logger.warning("%s: %s %s returned %d", self.name,
+                                   method, url, response.status_code)
+                self._done(callback, response)
+                return response
+            error = "status %d" % response.status_code
+        if tries >= MAX_TRIES:
+            logger.error("%s: giving up %s %s after %d tries: %s",
+                         self.name, method, url, tries, error)
+            self._done(callback, None)
+            return None
+        delay = RETRY_DELAY * 2 ** (tries - 1)
+        logger.warning("%s: %s %s failed (%s), retrying in %d seconds",
+                       self.name, method, url, error, delay)
+        with self._cond:
+            if key in self._pending:
+                # Superseded while being sent, the newer request wins
+                return None
+            self._schedule(
+                time.time() + delay,
+                (method, url, kwargs, tries + 1, callback), key
+            )
+        return None
+
+    def _done(self, callback, response):
+        if callback is None:
+            return
+        try:
+            callback(response)
+        except Exception:
+            logger.exception("%s: callback of request failed", self.name)
@@ -28,6 +28,16 @@ class RunbotBranch(models.Model):
     project_id = fields.Integer('VCS Project', select=1)
     merge_request_id = fields.Integer('Merge Request', select=1)
 
+    def _auto_init(self, cr, context=None):
+        res = super(RunbotBranch, self)._auto_init(cr, context=context)
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s",
+                   ('runbot_branch_repo_branch_name_index',))
+        if not cr.fetchone():
+            cr.execute("""
+CREATE INDEX runbot_branch_repo_branch_name_index
+ON runbot_branch (repo_id, branch_name)""")
+        return res
+
     def _get_branch_url(self, cr, uid, ids, field_name, arg, context=None):
         """For gitlab branches get gitlab MR formatted branches
 
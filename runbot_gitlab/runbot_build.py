@@ -20,9 +20,88 @@
 #
 ##############################################################################
 
+import simplejson
+
 from openerp.osv import orm
 
-from .runbot_repo import escape_branch_name
+from .cache import LRUCache
+from .dispatch import STATUS_CHANNEL, dispatch
+from .runbot_repo import escape_branch_name, set_gitlab_commit_status
+
+# Seconds during which a status is served from the cache. Caches are per
+# worker, invalidated by repo when the STATUS_CHANNEL notification of a
+# build change arrives, the ttl only covers lost notifications.
+STATUS_CACHE_TTL = 10
+
+# Gitlab status and etag of commits by (repo id, sha or sha prefix)
+status_cache = LRUCache(size=4096, ttl=STATUS_CACHE_TTL)
+
+# Id of the last non skipped build of branches by (repo id, branch name)
+ref_cache = LRUCache(size=1024, ttl=STATUS_CACHE_TTL)
+
+# Badge state, svg and etag of branches by (repo id, branch name)
+badge_cache = LRUCache(size=1024, ttl=STATUS_CACHE_TTL)
+
+# Number of invalidations of the caches of each repo by repo id as a string,
+# and of all of them by None, see get_cache_generation
+cache_generations = {}
+
+
+def get_cache_generation(repo_id):
+    """Get the generation of the caches of a repo
+
+    Values read from the database are only cached if the generation
+    didn't change meanwhile, otherwise a notified change could be cached
+    over by a request which read the database before it was committed.
+    """
+    return (cache_generations.get(None, 0),
+            cache_generations.get(str(repo_id), 0))
+
+
+def invalidate_repo_caches(dbname, repo_ids):
+    """Drop the cached statuses of the notified repos, all if None"""
+    if repo_ids is None:
+        cache_generations[None] = cache_generations.get(None, 0) + 1
+        for cache in (status_cache, ref_cache, badge_cache):
+            cache.invalidate()
+        return
+    repo_ids = set(str(repo_id) for repo_id in repo_ids)
+    for repo_id in repo_ids:
+        cache_generations[repo_id] = cache_generations.get(repo_id, 0) + 1
+    for cache in (status_cache, ref_cache, badge_cache):
+        cache.invalidate(lambda key: str(key[0]) in repo_ids)
+
+
+dispatch.subscribe(invalidate_repo_caches)
+
+
+def get_gitlab_status(state, result):
+    """Get the gitlab status matching a runbot build state and result"""
+    if result == 'ko':
+        return 'failed'
+    elif state == 'pending':
+        return 'pending'
+    elif state == 'testing':
+        return 'pending'
+    elif state == 'running':
+        return 'running'
+    elif result in ['ok', 'warn']:
+        return 'success'
+    return 'unknown'
+
+
+def get_gitlab_commit_state(state, result):
+    """Get the state of gitlab's commit status API matching a runbot build
+    state and result"""
+    if result == 'ko':
+        return 'failed'
+    elif result in ['ok', 'warn']:
+        return 'success'
+    elif result in ['skipped', 'killed', 'manually_killed']:
+        return 'canceled'
+    elif state == 'testing':
+        return 'running'
+    return 'pending'
 
 
 class runbot_build(orm.Model):
@@ -45,3 +124,87 @@ class runbot_build(orm.Model):
                 cr, uid, other_ids, field_name, arg, context=context
             ))
         return r
+
+    def _auto_init(self, cr, context=None):
+        res = super(runbot_build, self)._auto_init(cr, context=context)
+        # Index prefix searches of commits (name =like 'sha%') by repo
+        cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s",
+                   ('runbot_build_repo_name_prefix_index',))
+        if not cr.fetchone():
+            cr.execute("""
+CREATE INDEX runbot_build_repo_name_prefix_index
+ON runbot_build (repo_id, name varchar_pattern_ops)""")
+        return res
+
+    def create(self, cr, uid, values, context=None):
+        build_id = super(runbot_build, self).create(
+            cr, uid, values, context=context
+        )
+        self._gitlab_status_changed(cr, uid, [build_id], context=context)
+        return build_id
+
+    def write(self, cr, uid, ids, values, context=None):
+        res = super(runbot_build, self).write(
+            cr, uid, ids, values, context=context
+        )
+        if 'state' in values or 'result' in values:
+            if isinstance(ids, (int, long)):
+                ids = [ids]
+            self._gitlab_status_changed(cr, uid, ids, context=context)
+        return res
+
+    def _gitlab_status_changed(self, cr, uid, ids, context=None):
+        """Drop cached gitlab statuses of the commits and branches of builds,
+        notify their repos on the STATUS_CHANNEL postgres channel and queue
+        the publication of their status on gitlab
+
+        Notifications are only sent by postgres once the transaction is
+        committed.
+        """
+        shas = set()
+        repo_ids = set()
+        runbot_domain = None
+        for build in self.browse(cr, uid, ids, context=context):
+            shas.add(build.name)
+            repo_ids.add(build.repo_id.id)
+            ref_key = (build.repo_id.id, build.branch_id.branch_name)
+            ref_cache.pop(ref_key)
+            badge_cache.pop(ref_key)
+            repo = build.repo_id
+            if not (repo.uses_gitlab and repo.gitlab_publish_status and
+                    repo.token):
+                continue
+            if runbot_domain is None:
+                runbot_domain = self.pool['runbot.repo'].domain(
+                    cr, uid, context=context
+                )
+            set_gitlab_commit_status(
+                repo.token, repo.name, build.name,
+                get_gitlab_commit_state(build.state, build.result),
+                "http://%s/runbot/build/%d" % (runbot_domain, build.id),
+                description=' '.join(
+                    filter(None, [build.state, build.result])
+                ),
+            )
+        status_cache.invalidate(
+            lambda key: any(sha.startswith(key[1]) for sha in shas)
+        )
+        if repo_ids:
+            cr.execute("NOTIFY " + STATUS_CHANNEL + ", %s",
+                       (simplejson.dumps(sorted(repo_ids)),))
+
+    def skip_pending(self, cr, uid, domain, context=None):
+        """Skip at once the pending builds matching domain
+
+        :param list domain: search domain of the builds to skip
+        :returns int: number of skipped builds
+        """
+        ids = self.search(
+            cr, uid, domain + [('state', '=', 'pending')], context=context
+        )
+        if ids:
+            self.write(cr, uid, ids, {
+                'state': 'done',
+                'result': 'skipped',
+            }, context=context)
+        return len(ids)
@@ -0,0 +1,129 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+
+from openerp import models, fields, api
+
+from .runbot_repo import OPENED_STATES
+
+logger = logging.getLogger(__name__)
+
+try:
+    from gitlab3.exceptions import ResourceNotFound
+except ImportError as exc:
+    # don't fail at load if gitlab module is not available
+    pass
+
+
+class RunbotGitlabEvent(models.Model):
+    """Merge request and push notifications sent by a Gitlab webhook
+
+    Events are queued by the controller and consumed by the next
+    runbot.repo update, which then only has to look at what changed.
+    """
+    _name = "runbot.gitlab.event"
+    _order = "id"
+
+    repo_id = fields.Many2one(
+        'runbot.repo', 'Repository', required=True, ondelete='cascade',
+        select=1,
+    )
+    event_type = fields.Selection([
+        ('merge_request', 'Merge Request'),
+        ('push', 'Push'),
+    ], 'Type', required=True)
+    project_id = fields.Integer('VCS Project')
+    merge_request_id = fields.Integer('Merge Request')
+    merge_request_iid = fields.Integer('Merge Request Number')
+    merge_request_state = fields.Char('Merge Request State')
+    ref = fields.Char('Ref')
+    sha = fields.Char('Commit')
+
+    @api.model
+    def create_from_hook(self, repo_id, payload):
+        """Queue the merge request or push described by a webhook payload
+
+        :param int repo_id: id of the runbot.repo the hook was sent for
+        :param dict payload: decoded body of the webhook request
+        :returns: created event, empty recordset for unhandled events
+        """
+        kind = payload.get('object_kind')
+        if kind == 'merge_request':
+            attrs = payload.get('object_attributes') or {}
+            last_commit = attrs.get('last_commit') or {}
+            vals = {
+                'project_id': attrs.get('target_project_id'),
+                'merge_request_id': attrs.get('id'),
+                'merge_request_iid': attrs.get('iid'),
+                'merge_request_state': attrs.get('state'),
+                'ref': attrs.get('source_branch'),
+                'sha': last_commit.get('id'),
+            }
+        elif kind == 'push':
+            vals = {
+                'project_id': payload.get('project_id'),
+                'ref': payload.get('ref'),
+                'sha': payload.get('after'),
+            }
+        else:
+            logger.debug("Ignoring gitlab %s event for repo %s",
+                         kind, repo_id)
+            return self.browse()
+        vals.update({
+            'repo_id': repo_id,
+            'event_type': kind,
+        })
+        return self.create(vals)
+
+    @api.multi
+    def get_merge_requests(self, project):
+        """Resolve queued merge request events against gitlab
+
+        Only the last event of each merge request is considered. Events of
+        other projects and merge requests gitlab doesn't know are ignored.
+
+        :param gitlab3.Project project: project the events were sent for
+        :returns tuple: opened merge requests and numbers (iid) of closed
+            ones
+        """
+        last_events = {}
+        for event in self:
+            if event.event_type != 'merge_request':
+                continue
+            if event.project_id != project.id:
+                logger.warning("Ignoring merge request event of project %s "
+                               "for project %s", event.project_id,
+                               project.id)
+                continue
+            last_events[event.merge_request_id] = event
+        opened, closed = [], []
+        for mr_id, event in last_events.iteritems():
+            if event.merge_request_state in OPENED_STATES:
+                try:
+                    opened.append(project.merge_request(mr_id))
+                except ResourceNotFound:
+                    logger.warning("Ignoring event of unknown merge request "
+                                   "%s of project %s", mr_id, project.id)
+            elif event.merge_request_state == 'closed':
+                closed.append(event.merge_request_iid)
+        return opened, closed
@@ -20,15 +20,19 @@
 #
 ##############################################################################
 
+import hashlib
 import re
 import logging
+import threading
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from urllib import quote_plus
 import urllib
+import urlparse
 import unicodedata
 
-import requests
 try:
-    from gitlab3 import GitLab
+    from gitlab3.exceptions import ResourceNotFound
 except ImportError as exc:
     # don't fail at load if gitlab module is not available
     pass
@@ -37,9 +41,51 @@ from openerp import models, fields, api, exceptions
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT
 from openerp.tools.translate import _
 
+from .cache import LRUCache
+from .gitlab_client import get_gitlab_client
+from .outbound import OutboundQueue
+
 logger = logging.getLogger(__name__)
 
 GITLAB_CI_SETTINGS_URL = '%s/api/v3/projects/%s/services/gitlab-ci'
+GITLAB_COMMIT_STATUS_URL = '%s/api/v3/projects/%s/statuses/%s'
+
+# Requests configuring the gitlab CI service of projects
+outbound_queue = OutboundQueue('gitlab-ci-conf')
+
+# Signature of the CI configuration of repos by (database, repo id), queued
+# and not sent yet, so updates don't queue it again meanwhile, and accepted
+# by gitlab, to be saved by the next update
+pending_ci_confs = {}
+pushed_ci_confs = {}
+ci_confs_lock = threading.Lock()
+
+# Seconds during which status updates of a commit are coalesced, which also
+# leaves time to the transaction changing the build to be committed
+STATUS_COALESCE_DELAY = 3
+
+# Requests setting the status of commits
+status_queue = OutboundQueue('gitlab-status')
+
+# Seconds during which a gitlab project is reused without asking gitlab
+PROJECT_CACHE_TTL = 300
+
+# Gitlab projects by (domain, token, id) and (domain, token, name)
+project_cache = LRUCache(size=512, ttl=PROJECT_CACHE_TTL)
+
+# Seconds during which the protected branches of a project are reused
+PROTECTED_BRANCHES_TTL = 600
+
+# Names of protected branches by (domain, project id)
+protected_branches_cache = LRUCache(size=512, ttl=PROTECTED_BRANCHES_TTL)
+
+# Number of merge requests asked to gitlab at once
+MR_PAGE_SIZE = 100
+
+OPENED_STATES = ('opened', 'reopened')
+
+# Default number of concurrent requests sent to a gitlab host
+DEFAULT_CONCURRENCY = 4
 
 
 branch_name_subs = [
@@ -104,6 +150,8 @@ def get_gitlab_params(base):
 def get_gitlab_project(base, token, project_id=None):
     """Retrieve gitlab project using either id or name
 
+    Projects are cached for PROJECT_CACHE_TTL seconds by id and by name.
+
     :param str base: url base of project containing domain and project name
     :param str token: gitlab user's token
     :param int or None project_id: optional id of project to get
@@ -111,20 +159,160 @@ def get_gitlab_project(base, token, project_id=None):
     :raises exceptions.ValidationError: Repo couldn't be found by name or id
     """
     domain, name = get_gitlab_params(base)
-    gl = GitLab(domain, token)
-    if project_id:
-        res = gl.project(project_id)
-    else:
-        res = gl.find_project(path_with_namespace=name)
+    gl = get_gitlab_client(domain, token)
+    res = project_cache.get((domain, token, project_id or name))
+    if res is not None:
+        return res
+    try:
+        # gitlab accepts the url encoded name where an id is expected
+        res = gl.project(project_id or name)
+    except ResourceNotFound:
+        res = None
     if not res:
         raise exceptions.ValidationError(
             _('Could not find repo with ') +
             (_("id=%d") % project_id if project_id else _("name=%s") % name)
         )
+    project_cache.set((domain, token, res.id), res)
+    project_cache.set((domain, token, res.path_with_namespace), res)
     return res
 
 
-def set_gitlab_ci_conf(token, gitlab_url, runbot_domain, repo_id):
+def get_protected_branches(base, project):
+    """Get the names of the protected and default branches of a project
+
+    Names are cached for PROTECTED_BRANCHES_TTL seconds.
+
+    :param str base: url base of project containing domain and project name
+    :param gitlab3.Project project: gitlab project
+    :returns frozenset: names of the branches
+    """
+    domain, _ = get_gitlab_params(base)
+    key = (domain, project.id)
+    res = protected_branches_cache.get(key)
+    if res is None:
+        res = set(
+            b.name for b in project.find_branch(find_all=True, protected=True)
+        )
+        res.add(project.default_branch)
+        res = frozenset(res)
+        protected_branches_cache.set(key, res)
+    return res
+
+
+def gitlab_map(func, items, concurrency):
+    """Apply func to items using at most concurrency threads
+
+    func must not use the database, cursors can't be shared between threads.
+
+    :param function func: function called with each item
+    :param list items: arguments of func
+    :param int concurrency: maximum number of threads
+    :returns list: results of func, in the order of items
+    """
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return map(func, items)
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def to_utc(date):
+    """Convert a date given by gitlab to a naive UTC datetime"""
+    offset = date.utcoffset()
+    if offset:
+        date -= offset
+    return date.replace(tzinfo=None)
+
+
+def iter_merge_requests(project, updated_after=None):
+    """Stream merge requests of a project, most recently updated first
+
+    Merge requests are asked to gitlab one page at a time and the stream
+    stops at the first merge request updated before updated_after.
+
+    :param gitlab3.Project project: project of the merge requests
+    :param datetime or None updated_after: naive UTC lower bound of the
+        update date of merge requests
+    :returns: generator of gitlab3.MergeRequest
+    """
+    params = {
+        'order_by': 'updated_at',
+        'sort': 'desc',
+    }
+    if updated_after:
+        # Ignored by older gitlab versions, the stream is cut anyway
+        params['updated_after'] = updated_after.isoformat()
+    seen = set()
+    page = 1
+    while True:
+        page_mrs = project.merge_requests(
+            page=page, per_page=MR_PAGE_SIZE, **params
+        )
+        # Merge requests updated meanwhile shift the following pages, so
+        # pages may start with merge requests already streamed. Gitlab may
+        # also repeat the last page instead of returning nothing.
+        merge_requests = [mr for mr in page_mrs if mr.id not in seen]
+        if not merge_requests:
+            return
+        for mr in merge_requests:
+            if updated_after and to_utc(mr.updated_at) < updated_after:
+                return
+            seen.add(mr.id)
+            yield mr
+        if len(page_mrs) < MR_PAGE_SIZE:
+            return
+        page += 1
+
+
+def get_commit_vals(commit):
+    """Get the values of a runbot.build describing a gitlab commit
+
+    :param dict commit: commit as returned by gitlab
+    :returns dict: author, committer, subject and date of the commit
+    """
+    date = commit['committed_date']
+    if date.tzinfo:
+        # TODO: TMP workaround for tzinfo bug
+        # https://github.com/alexvh/python-gitlab3/issues/15
+        date.tzinfo.dst = lambda _: None
+    # In earlier versions of gitlab3, author and committer were a keys
+    # newer versions have author_name and committer_name
+    try:
+        author = commit['author']['name']
+    except KeyError:
+        author = commit['author_name']
+    try:
+        committer = commit['committer']['name']
+    except KeyError:
+        # Some gitlab versions only give the author of commits
+        committer = commit.get('committer_name') or author
+    return {
+        'author': author,
+        'committer': committer,
+        'subject': commit['message'],
+        'date': date.strftime(DEFAULT_SERVER_DATETIME_FORMAT),
+    }
+
+
+def set_gitlab_ci_conf(token, gitlab_url, runbot_domain, repo_id,
+                       callback=None, key=None):
+    """Queue the configuration of the gitlab CI service of a project
+
+    :param str token: gitlab user's token
+    :param str gitlab_url: url of the gitlab repo
+    :param str runbot_domain: domain gitlab has to call back
+    :param int repo_id: id of the runbot.repo
+    :param function callback: called with the response of gitlab, None if
+        it couldn't be reached
+    :param key: coalescing key of the configuration, the gitlab project by
+        default. The callback of a configuration replaced by a newer one of
+        the same key is never called.
+    """
     if not token:
         raise models.except_orm(
             _('Error!'),
@@ -141,33 +329,142 @@ def set_gitlab_ci_conf(token, gitlab_url, runbot_domain, repo_id):
     headers = {
         "PRIVATE-TOKEN": token,
     }
-    requests.put(url, data=data, headers=headers)
+    outbound_queue.put('PUT', url, key=key or (domain, name),
+                       callback=callback, data=data, headers=headers)
+
+
+def ci_conf_pushed(key, signature):
+    """Make the callback of the push of the CI configuration of a repo
+
+    :param tuple key: database and id of the repo
+    :param str signature: signature of the configuration pushed
+    """
+    def callback(response):
+        with ci_confs_lock:
+            if pending_ci_confs.get(key) == signature:
+                del pending_ci_confs[key]
+            if response is not None and response.ok:
+                pushed_ci_confs[key] = signature
+    return callback
+
+
+def set_gitlab_commit_status(token, gitlab_url, sha, state, target_url,
+                             description=None):
+    """Queue the publication of a commit status on gitlab
+
+    Statuses of the same commit queued within STATUS_COALESCE_DELAY seconds
+    are coalesced, only the last one is sent.
+
+    :param str token: gitlab user's token
+    :param str gitlab_url: url of the gitlab repo
+    :param str sha: commit sha
+    :param str state: pending, running, success, failed or canceled
+    :param str target_url: url of the build
+    :param str description: short description of the status
+    """
+    domain, name = get_gitlab_params(gitlab_url.replace(':', '/'))
+    url = GITLAB_COMMIT_STATUS_URL % (domain, quote_plus(name), sha)
+    data = {
+        "state": state,
+        "target_url": target_url,
+        "name": "runbot",
+    }
+    if description:
+        data["description"] = description
+    headers = {
+        "PRIVATE-TOKEN": token,
+    }
+    status_queue.put('POST', url, delay=STATUS_COALESCE_DELAY,
+                     key=(domain, name, sha), data=data, headers=headers)
 
 
 class RunbotRepo(models.Model):
     _inherit = "runbot.repo"
     uses_gitlab = fields.Boolean('Use Gitlab')
+    gitlab_use_webhook = fields.Boolean(
+        'Use Gitlab Webhook',
+        help="Only look at merge requests and pushes notified on "
+             "/gitlab-ci/<repo id>/hook, gitlab is still fully polled "
+             "every Full Sync Interval",
+    )
+    gitlab_webhook_token = fields.Char(
+        'Webhook Secret Token',
+        help="Secret token configured on the gitlab webhook, hooks are "
+             "refused without it",
+    )
+    gitlab_full_sync_interval = fields.Integer(
+        'Full Sync Interval',
+        default=60,
+        help="Minutes between two full polls of gitlab when using webhook",
+    )
+    gitlab_last_full_sync = fields.Datetime('Last Full Sync', readonly=True)
+    gitlab_publish_status = fields.Boolean(
+        'Publish Commit Statuses',
+        help="Post build statuses to the commit status API of gitlab as "
+             "builds change instead of waiting for gitlab to poll them",
+    )
+    gitlab_ci_conf_signature = fields.Char(
+        'Gitlab CI Configuration Signature', readonly=True, copy=False,
+    )
+    gitlab_mr_updated_after = fields.Datetime(
+        'Merge Requests Updated After',
+        help="Only merge requests updated since this date are asked to "
+             "gitlab when polling it, empty to look at all of them",
+    )
 
     @api.model
     def create(self, vals):
         repo_id = super(RunbotRepo, self).create(vals)
-        set_gitlab_ci_conf(
-            vals.get('token'),
-            vals.get('name'),
-            self.domain(),
-            repo_id.id,
-        )
+        repo_id._gitlab_push_ci_conf()
         return repo_id
 
     @api.multi
     def write(self, vals):
-        super(RunbotRepo, self).write(vals)
-        set_gitlab_ci_conf(
-            vals.get('token', self.token),
-            vals.get('name', self.name),
-            self.domain(),
-            self.id,
-        )
+        res = super(RunbotRepo, self).write(vals)
+        self._gitlab_push_ci_conf()
+        return res
+
+    @api.multi
+    def _gitlab_push_ci_conf(self):
+        """Configure the gitlab CI service of gitlab repos whose token, name
+        or runbot domain changed since it was last done
+
+        The signature of the configuration is only saved by the update
+        following its acceptance by gitlab, see ci_conf_pushed. Until then
+        updates push it again unless it is still queued.
+        """
+        runbot_domain = self.domain()
+        for repo in self:
+            if not repo.uses_gitlab:
+                continue
+            signature = hashlib.sha1(u'\n'.join([
+                repo.token or u'',
+                repo.name,
+                runbot_domain,
+            ]).encode('utf-8')).hexdigest()
+            if signature == repo.gitlab_ci_conf_signature:
+                continue
+            key = (self._cr.dbname, repo.id)
+            with ci_confs_lock:
+                if pushed_ci_confs.get(key) == signature:
+                    del pushed_ci_confs[key]
+                    pushed = True
+                else:
+                    pushed = False
+                    if pending_ci_confs.get(key) == signature:
+                        continue
+                    pending_ci_confs[key] = signature
+            if pushed:
+                super(RunbotRepo, repo).write({
+                    'gitlab_ci_conf_signature': signature,
+                })
+                continue
+            # Coalesced by repo, repos of several databases may configure
+            # the same project and each waits for its own callback
+            set_gitlab_ci_conf(
+                repo.token, repo.name, runbot_domain, repo.id,
+                callback=ci_conf_pushed(key, signature), key=key,
+            )
 
     @api.one
     @gitlab_api
@@ -185,93 +482,199 @@ class RunbotRepo(models.Model):
             r = {}
         return r
 
-    @api.one
-    @gitlab_api
-    def update(self):
-        project = get_gitlab_project(self.base, self.token)
-
-        merge_requests = project.find_merge_request(
-            find_all=True
+    def _gitlab_concurrency(self):
+        """Number of concurrent requests sent to the gitlab host of the repo
+
+        Read from the runbot_gitlab.concurrency.HOST system parameter, then
+        from runbot_gitlab.concurrency.
+        """
+        domain, _ = get_gitlab_params(self.base)
+        host = urlparse.urlparse(domain).netloc
+        icp = self.env['ir.config_parameter']
+        concurrency = (
+            icp.get_param('runbot_gitlab.concurrency.%s' % host) or
+            icp.get_param('runbot_gitlab.concurrency') or
+            DEFAULT_CONCURRENCY
         )
-        # Find new MRs and new builds
-        for mr in project.find_merge_request(
-                find_all=True,
-                cached=merge_requests,
-                state='opened'):
-            source_project = get_gitlab_project(
-                self.base, self.token, mr.source_project_id
-            )
-            source_branch = source_project.branch(name=mr.source_branch)
-            commit = source_branch.commit
-            sha = commit['id']
-            date = commit['committed_date']
-            # TODO: TMP workaround for tzinfo bug
-            # https://github.com/alexvh/python-gitlab3/issues/15
-            date.tzinfo.dst = lambda _: None
-            # In earlier versions of gitlab3, author and committer were a keys
-            # newer versions have author_name and committer_name
-            try:
-                author = commit['author']['name']
-            except KeyError:
-                author = commit['author_name']
-            try:
-                committer = commit['committer']['name']
-            except KeyError:
-                committer = commit['committer_name']
-            subject = commit['message']
-            title = mr.title
-            # Create or get branch
-            branch_ids = self.env['runbot.branch'].search([
-                ('repo_id', '=', self.id),
-                ('project_id', '=', project.id),
-                ('merge_request_id', '=', mr.iid),
-            ])
-            if branch_ids:
-                branch_id = branch_ids[0]
-            else:
-                logger.debug('repo %s found new Merge Proposal %s',
-                             self.name, title)
-                branch_id = self.env['runbot.branch'].create({
-                    'repo_id': self.id,
-                    'name': title,
-                    'project_id': project.id,
-                    'merge_request_id': mr.iid,
-                })
-            # Create build (and mark previous builds as skipped) if not found
-            build_ids = self.env['runbot.build'].search([
-                ('branch_id', '=', branch_id.id),
-                ('name', '=', sha),
-            ])
-            if not build_ids:
-                logger.debug(
-                    'repo %s merge request %s new build found commit %s',
-                    branch_id.repo_id.name,
-                    branch_id.name,
-                    sha,
+        return max(1, int(concurrency))
+
+    def _gitlab_sync_merge_requests(self, project, merge_requests):
+        """Find new MRs and new builds
+
+        The head of merge requests is read from the listing and commits are
+        only asked to gitlab for shas which were never built in this repo.
+        Gitlab is queried concurrently, the database is only used from the
+        current thread.
+
+        :param gitlab3.Project project: gitlab project of the repo
+        :param list merge_requests: opened gitlab merge requests
+        """
+        base, token = self.base, self.token
+        concurrency = self._gitlab_concurrency()
+
+        def get_head(mr):
+            sha = getattr(mr, 'sha', None)
+            if not sha:
+                # Older gitlab versions don't list the head of merge requests
+                source_project = get_gitlab_project(
+                    base, token, mr.source_project_id
                 )
-                self.env['runbot.build'].create({
-                    'branch_id': branch_id.id,
-                    'name': sha,
-                    'author': author,
-                    'committer': committer,
-                    'subject': subject,
-                    'date': date.strftime(DEFAULT_SERVER_DATETIME_FORMAT),
-                    'modules': branch_id.repo_id.modules,
-                })
+                source_branch = source_project.branch(name=mr.source_branch)
+                sha = source_branch.commit['id']
+            return mr, sha
 
-        # Clean-up old MRs
-        closed_mrs = list(i.id for i in project.find_merge_request(
-            find_all=True,
-            cached=merge_requests,
-            state='closed'
-        ))
+        def get_commit(args):
+            sha, source_project_id = args
+            source_project = get_gitlab_project(base, token, source_project_id)
+            return sha, get_commit_vals(source_project.commit(sha)._get_data())
 
-        closed_mrs = self.env['runbot.branch'].search([
+        heads = gitlab_map(get_head, merge_requests, concurrency)
+
+        builds = self.env['runbot.build'].search([
+            ('repo_id', '=', self.id),
+            ('name', 'in', list(set(sha for _, sha in heads))),
+        ])
+        built = set((build.branch_id.id, build.name) for build in builds)
+        known_commits = {}
+        for build in builds:
+            known_commits[build.name] = {
+                'author': build.author,
+                'committer': build.committer,
+                'subject': build.subject,
+                'date': build.date,
+            }
+        unseen = {}
+        for mr, sha in heads:
+            if sha not in known_commits:
+                unseen.setdefault(sha, mr.source_project_id)
+        known_commits.update(
+            gitlab_map(get_commit, unseen.items(), concurrency)
+        )
+
+        branches = {}
+        for branch in self.env['runbot.branch'].search([
+                ('repo_id', '=', self.id),
+                ('project_id', '=', project.id),
+                ('merge_request_id', 'in', [mr.iid for mr, _ in heads]),
+        ]):
+            branches.setdefault(branch.merge_request_id, branch)
+
+        # Create missing branches
+        for mr, _ in heads:
+            if mr.iid in branches:
+                continue
+            logger.debug('repo %s found new Merge Proposal %s',
+                         self.name, mr.title)
+            branches[mr.iid] = self.env['runbot.branch'].create({
+                'repo_id': self.id,
+                'name': mr.title,
+                'project_id': project.id,
+                'merge_request_id': mr.iid,
+            })
+
+        # Create build (and mark previous builds as skipped) if not found
+        new_builds = []
+        for mr, sha in heads:
+            branch_id = branches[mr.iid]
+            if (branch_id.id, sha) in built:
+                continue
+            built.add((branch_id.id, sha))
+            logger.debug(
+                'repo %s merge request %s new build found commit %s',
+                self.name,
+                branch_id.name,
+                sha,
+            )
+            vals = dict(known_commits[sha])
+            vals.update({
+                'branch_id': branch_id.id,
+                'name': sha,
+                'modules': self.modules,
+            })
+            new_builds.append(vals)
+        for vals in new_builds:
+            self.env['runbot.build'].create(vals)
+
+    def _gitlab_clean_merge_requests(self, project, closed_mrs):
+        """Clean-up old MRs
+
+        Branches of closed merge requests are deleted at once along with
+        their builds. Builds still testing or running are killed first, their
+        directories and databases are left to runbot_janitor when installed.
+
+        :param gitlab3.Project project: gitlab project of the repo
+        :param list closed_mrs: numbers (iid) of closed gitlab merge requests
+        """
+        if not closed_mrs:
+            return
+        branches = self.env['runbot.branch'].search([
+            ('repo_id', '=', self.id),
+            ('project_id', '=', project.id),
             ('merge_request_id', 'in', closed_mrs),
         ])
+        if not branches:
+            return
+        self.env['runbot.build'].search([
+            ('branch_id', 'in', branches.ids),
+            ('state', 'in', ['testing', 'running']),
+        ]).kill()
+        logger.debug('repo %s removing %d closed merge requests',
+                     self.name, len(branches))
+        branches.unlink()
+
+    def _gitlab_full_sync_due(self):
+        """Whether gitlab has to be fully polled on this update"""
+        if not self.gitlab_use_webhook or not self.gitlab_last_full_sync:
+            return True
+        last_sync = fields.Datetime.from_string(self.gitlab_last_full_sync)
+        interval = timedelta(minutes=self.gitlab_full_sync_interval)
+        return datetime.now() - last_sync >= interval
 
-        for mr in closed_mrs:
-            mr.unlink()
+    @api.one
+    @gitlab_api
+    def update(self):
+        # Catch up on runbot domain changes
+        self._gitlab_push_ci_conf()
+        full_sync = self._gitlab_full_sync_due()
+        events = self.env['runbot.gitlab.event'].search([
+            ('repo_id', '=', self.id),
+        ])
+        if not full_sync and not events:
+            # Nothing was notified since last update
+            return
+        project = get_gitlab_project(self.base, self.token)
+        if events.filtered(lambda e: e.event_type == 'push'):
+            # Pushes may have created or protected branches
+            domain, _ = get_gitlab_params(self.base)
+            protected_branches_cache.pop((domain, project.id))
+
+        if full_sync:
+            updated_after = None
+            if self.gitlab_mr_updated_after:
+                updated_after = fields.Datetime.from_string(
+                    self.gitlab_mr_updated_after
+                )
+            cursor = updated_after
+            opened_mrs, closed_mrs = [], []
+            for mr in iter_merge_requests(project, updated_after):
+                if cursor is None or to_utc(mr.updated_at) > cursor:
+                    cursor = to_utc(mr.updated_at)
+                if mr.state in OPENED_STATES:
+                    opened_mrs.append(mr)
+                elif mr.state == 'closed':
+                    closed_mrs.append(mr.iid)
+        else:
+            opened_mrs, closed_mrs = events.get_merge_requests(project)
+
+        self._gitlab_sync_merge_requests(project, opened_mrs)
+        self._gitlab_clean_merge_requests(project, closed_mrs)
+        events.unlink()
+        if full_sync:
+            self.write({
+                'gitlab_last_full_sync': fields.Datetime.now(),
+                'gitlab_mr_updated_after': cursor and
+                fields.Datetime.to_string(cursor),
+            })
 
         super(RunbotRepo, self).update()
 
@@ -279,25 +682,31 @@ class RunbotRepo(models.Model):
         self._cr.commit()
         self._cr.autocommit(True)
 
-        # Put all protected branches as sticky
-        protected_branches = set(
-            b.name for b in project.find_branch(find_all=True, protected=True)
-        )
-        protected_branches.add(project.default_branch)
+        self._gitlab_stick_protected_branches(project)
+        self._gitlab_skip_pending_builds()
 
-        for branch in self.env['runbot.branch'].search([
-                ('branch_name', 'in', list(protected_branches)),
-                ('sticky', '=', False),
-        ]):
-            branch.write({'sticky': True})
+    def _gitlab_stick_protected_branches(self, project):
+        """Put all protected branches as sticky
 
-        # Skip non-sticky non-merge proposal builds
+        :param gitlab3.Project project: gitlab project of the repo
+        """
+        protected_branches = get_protected_branches(self.base, project)
+        self.env['runbot.branch'].search([
+            ('repo_id', '=', self.id),
+            ('branch_name', 'in', list(protected_branches)),
+            ('sticky', '=', False),
+        ]).write({'sticky': True})
+
+    def _gitlab_skip_pending_builds(self):
+        """Skip non-sticky non-merge proposal builds"""
         branches = self.env['runbot.branch'].search([
             ('sticky', '=', False),
             ('repo_id', 'in', [i.id for i in self]),
             ('project_id', '=', False),
             ('merge_request_id', '=', False),
         ])
-        for build in self.env['runbot.build'].search([
-                ('branch_id', 'in', [b.id for b in branches])]):
-            build.skip()
+        skipped = self.env['runbot.build'].skip_pending([
+            ('branch_id', 'in', branches.ids),
+        ])
+        if skipped:
+            logger.debug('repo %s skipped %d builds', self.name, skipped)
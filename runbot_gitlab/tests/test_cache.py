@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import time
+
+import unittest2
+
+from ..cache import LRUCache, count_lookups
+
+
+class TestLRUCache(unittest2.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(size=2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Looking up a makes b the least recently used entry
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache = LRUCache(size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=0.01)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+
+    def test_falsy_values(self):
+        cache = LRUCache()
+        cache.set('a', 0)
+        self.assertEqual(cache.get('a', 'default'), 0)
+
+    def test_pop(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertIsNone(cache.get('a'))
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set((1, 'abc'), 'success')
+        cache.set((2, 'abc'), 'failed')
+        cache.invalidate(lambda key: key[0] == 1)
+        self.assertIsNone(cache.get((1, 'abc')))
+        self.assertEqual(cache.get((2, 'abc')), 'failed')
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_count_lookups(self):
+        hits, misses = count_lookups()
+        cache = LRUCache()
+        cache.get('a')
+        cache.set('a', 1)
+        cache.get('a')
+        self.assertEqual(count_lookups(), (hits + 1, misses + 1))
@@ -0,0 +1,248 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import httplib
+import re
+import urllib
+
+import simplejson
+import unittest2
+
+from openerp.tests import HttpCase
+from openerp.tests.common import PORT
+
+from ..controllers import gitlab_ci_controller
+from ..controllers.gitlab_ci_controller import (
+    format_last,
+    parse_last,
+    status_etag,
+)
+from ..runbot_build import badge_cache, ref_cache, status_cache
+
+
+class TestPollCursor(unittest2.TestCase):
+
+    def test_first_poll(self):
+        self.assertEqual(parse_last(None), (None, {}))
+        self.assertEqual(parse_last('garbage'), (None, {}))
+
+    def test_round_trip(self):
+        since = '2016-01-01 12:00:00.123456'
+        seen = {12: 'running', 3: 'success'}
+        last = format_last(since, seen)
+        self.assertEqual(last, since + '|3:success,12:running')
+        self.assertEqual(parse_last(last), (since, seen))
+        self.assertEqual(parse_last(format_last(since, {})), (since, {}))
+
+
+class TestStatusEtag(unittest2.TestCase):
+
+    def test_status_etag(self):
+        build = {'id': 1, 'write_date': '2016-01-01 12:00:00'}
+        etag = status_etag('running', build)
+        self.assertEqual(etag, status_etag('running', dict(build)))
+        self.assertNotEqual(etag, status_etag('success', build))
+        self.assertNotEqual(etag, status_etag(
+            'running', dict(build, write_date='2016-01-01 12:00:01')))
+        self.assertNotEqual(status_etag('failed'), status_etag('success'))
+
+
+class TestGitlabCIController(HttpCase):
+
+    def setUp(self):
+        super(TestGitlabCIController, self).setUp()
+        # Requests are served with the test cursor of the registry, not the
+        # cursor of the test case
+        self.env = self.env(cr=self.registry.test_cr)
+        for cache in (status_cache, ref_cache, badge_cache):
+            cache.invalidate()
+        # Nothing listens on port 1, the requests queued for gitlab are
+        # given up in the background
+        self.repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'uses_gitlab': True,
+            'token': 'secret',
+        })
+        branch = self.env['runbot.branch'].create({
+            'repo_id': self.repo.id,
+            'name': 'refs/heads/master',
+        })
+        self.running = self.env['runbot.build'].create({
+            'branch_id': branch.id,
+            'name': 'a' * 40,
+            'state': 'running',
+            'result': 'ok',
+        })
+        self.failed = self.env['runbot.build'].create({
+            'branch_id': branch.id,
+            'name': 'b' * 40,
+            'state': 'done',
+            'result': 'ko',
+        })
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request to the server, without following redirections
+        nor raising on errors
+
+        :returns tuple: response and its body
+        """
+        headers = dict(headers or {})
+        headers['Cookie'] = 'session_id=%s' % self.session_id
+        connection = httplib.HTTPConnection('localhost', PORT, timeout=10)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def test_builds_status(self):
+        path = '/gitlab-ci/%d/builds/%s/status.json' % (self.repo.id,
+                                                        'a' * 8)
+        response, body = self.request('GET', path)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(simplejson.loads(body)['status'], 'running')
+        etag = response.getheader('ETag')
+        self.assertTrue(etag)
+        # Cached or not, an unchanged status isn't sent again
+        for _ in range(2):
+            response, body = self.request(
+                'GET', path, headers={'If-None-Match': etag})
+            self.assertEqual(response.status, 304)
+            self.assertEqual(body, '')
+        response, body = self.request(
+            'GET', path.replace('/builds/', '/commits/'),
+            headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+
+    def test_build_view(self):
+        path = '/gitlab-ci/%d/commits/%s' % (self.repo.id, 'b' * 8)
+        response, _ = self.request('GET', path)
+        self.assertEqual(response.status, 302)
+        self.assertTrue(response.getheader('Location').endswith(
+            '/runbot/build/%d' % self.failed.id))
+        response, _ = self.request(
+            'GET', path, headers={'If-None-Match': response.getheader('ETag')})
+        self.assertEqual(response.status, 304)
+
+    def test_statuses(self):
+        response, body = self.request(
+            'GET', '/gitlab-ci/%d/statuses.json?shas=%s,%s,%s,%s' % (
+                self.repo.id, 'A' * 7, 'b' * 40, 'c' * 40, 'a' * 7))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(simplejson.loads(body)['statuses'], [
+            {'sha': 'a' * 7, 'status': 'running'},
+            {'sha': 'b' * 40, 'status': 'failed'},
+            {'sha': 'c' * 40, 'status': 'failed'},
+        ])
+        # The cached status is dropped when the build changes
+        self.running.write({'state': 'done'})
+        response, body = self.request(
+            'GET', '/gitlab-ci/%d/statuses.json?shas=%s' % (
+                self.repo.id, 'a' * 7))
+        self.assertEqual(simplejson.loads(body)['statuses'], [
+            {'sha': 'a' * 7, 'status': 'success'},
+        ])
+
+    def poll(self, **params):
+        response, body = self.request(
+            'GET', '/longpolling/gitlab-ci/%d/statuses?%s' % (
+                self.repo.id, urllib.urlencode(params)))
+        self.assertEqual(response.status, 200)
+        res = simplejson.loads(body)
+        return res['last'], [(status['build_id'], status['status'])
+                             for status in res['statuses']]
+
+    def test_poll_statuses(self):
+        poll_timeout = gitlab_ci_controller.POLL_TIMEOUT
+        gitlab_ci_controller.POLL_TIMEOUT = 0.1
+        self.addCleanup(setattr, gitlab_ci_controller, 'POLL_TIMEOUT',
+                        poll_timeout)
+        latest = self.env['runbot.build'].create({
+            'branch_id': self.running.branch_id.id,
+            'name': 'c' * 40,
+        })
+        # Polls release the cursor of their request, which rolls the test
+        # cursor back to its last commit
+        self.env.cr.commit()
+        # First polls answer the last build of each branch and commit
+        _, statuses = self.poll(refs='master')
+        self.assertEqual(statuses, [(latest.id, 'pending')])
+        last, statuses = self.poll(shas='a' * 7 + ',xyz')
+        self.assertEqual(statuses, [(self.running.id, 'running')])
+        last, statuses = self.poll(shas='a' * 7, last=last)
+        self.assertEqual(statuses, [])
+        self.running.write({'state': 'done'})
+        # Builds written by the test cursor, which is never committed, are
+        # dated from the start of the test
+        self.env.cr.execute("""
+UPDATE runbot_build SET write_date = clock_timestamp() AT TIME ZONE 'UTC'
+WHERE id = %s""", (self.running.id,))
+        self.env.cr.commit()
+        last, statuses = self.poll(shas='a' * 7, last=last)
+        self.assertEqual(statuses, [(self.running.id, 'success')])
+
+    def test_poll_nothing(self):
+        """Polls without valid commit nor branch are refused at once"""
+        response, _ = self.request(
+            'GET', '/longpolling/gitlab-ci/%d/statuses?shas=xyz' % (
+                self.repo.id))
+        self.assertEqual(response.status, 400)
+
+    def test_metrics(self):
+        """Queries of routes releasing their cursor are still counted"""
+        # See test_poll_statuses
+        self.env.cr.commit()
+        self.poll(shas='a' * 7)
+        response, body = self.request('GET', '/gitlab-ci/metrics')
+        self.assertEqual(response.status, 200)
+        sums = dict(re.findall(
+            r'^runbot_gitlab_request_queries_sum\{route="(\w+)"\} (\S+)$',
+            body, re.M))
+        self.assertGreaterEqual(float(sums['poll_statuses']), 0)
+
+    def test_hook(self):
+        path = '/gitlab-ci/%d/hook' % self.repo.id
+        body = simplejson.dumps({
+            'object_kind': 'push',
+            'project_id': 1,
+            'ref': 'refs/heads/master',
+            'after': 'c' * 40,
+        })
+        events = self.env['runbot.gitlab.event']
+        # Not a webhook repo
+        response, _ = self.request('POST', path, body)
+        self.assertEqual(response.status, 404)
+        # A webhook without token is refused
+        self.repo.gitlab_use_webhook = True
+        response, _ = self.request('POST', path, body)
+        self.assertEqual(response.status, 403)
+        self.repo.gitlab_webhook_token = 'hook-secret'
+        response, _ = self.request('POST', path, body,
+                                   {'X-Gitlab-Token': 'wrong'})
+        self.assertEqual(response.status, 403)
+        self.assertFalse(events.search([('repo_id', '=', self.repo.id)]))
+        response, _ = self.request('POST', path, body,
+                                   {'X-Gitlab-Token': 'hook-secret'})
+        self.assertEqual(response.status, 200)
+        event = events.search([('repo_id', '=', self.repo.id)])
+        self.assertEqual(event.sha, 'c' * 40)
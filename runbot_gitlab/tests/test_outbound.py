@@ -0,0 +1,126 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+
+import requests
+import unittest2
+
+from .. import outbound
+from ..outbound import OutboundQueue
+
+# Seconds a test waits for the queue thread
+WAIT = 5
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+
+class FakeSession(object):
+    """Answer requests with the given status codes, the last one repeated,
+    an exception being raised instead of answered"""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs.get('data')))
+        status = (self.statuses.pop(0) if len(self.statuses) > 1
+                  else self.statuses[0])
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+
+
+class TestOutboundQueue(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestOutboundQueue, self).setUp()
+        self.retry_delay = outbound.RETRY_DELAY
+        self.max_tries = outbound.MAX_TRIES
+        outbound.RETRY_DELAY = 0.01
+        self.queue = OutboundQueue('test')
+        self.responses = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        outbound.RETRY_DELAY = self.retry_delay
+        outbound.MAX_TRIES = self.max_tries
+        super(TestOutboundQueue, self).tearDown()
+
+    def callback(self, response):
+        self.responses.append(response)
+        self.done.set()
+
+    def test_send(self):
+        self.queue.session = FakeSession(201)
+        self.queue.put('POST', 'http://gitlab/api', data={'state': 'ok'},
+                       callback=self.callback)
+        self.assertTrue(self.done.wait(WAIT))
+        self.assertEqual(self.queue.session.requests,
+                         [('POST', 'http://gitlab/api', {'state': 'ok'})])
+        self.assertEqual(self.responses[0].status_code, 201)
+
+    def test_coalesce(self):
+        """Only the last request of a key pending at once is sent"""
+        replaced = []
+        self.queue.session = FakeSession(200)
+        for state in ('pending', 'running'):
+            self.queue.put('POST', 'http://gitlab/api', delay=0.2,
+                           key='sha', data={'state': state},
+                           callback=replaced.append)
+        self.queue.put('POST', 'http://gitlab/api', delay=0.2, key='sha',
+                       data={'state': 'success'}, callback=self.callback)
+        self.assertTrue(self.done.wait(WAIT))
+        self.assertEqual(self.queue.session.requests,
+                         [('POST', 'http://gitlab/api',
+                           {'state': 'success'})])
+        self.assertEqual(replaced, [])
+
+    def test_retry(self):
+        """Server errors and connection errors are retried"""
+        self.queue.session = FakeSession(
+            502, requests.ConnectionError('refused'), 200)
+        self.queue.put('PUT', 'http://gitlab/api', callback=self.callback)
+        self.assertTrue(self.done.wait(WAIT))
+        self.assertEqual(len(self.queue.session.requests), 3)
+        self.assertEqual(self.responses[0].status_code, 200)
+
+    def test_client_error_not_retried(self):
+        self.queue.session = FakeSession(404, 200)
+        self.queue.put('PUT', 'http://gitlab/api', callback=self.callback)
+        self.assertTrue(self.done.wait(WAIT))
+        self.assertEqual(len(self.queue.session.requests), 1)
+        self.assertEqual(self.responses[0].status_code, 404)
+
+    def test_give_up(self):
+        outbound.MAX_TRIES = 2
+        self.queue.session = FakeSession(503)
+        self.queue.put('PUT', 'http://gitlab/api', callback=self.callback)
+        self.assertTrue(self.done.wait(WAIT))
+        self.assertEqual(len(self.queue.session.requests), 2)
+        self.assertEqual(self.responses, [None])
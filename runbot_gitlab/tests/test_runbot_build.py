@@ -0,0 +1,177 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import time
+
+import unittest2
+
+from openerp.tests import TransactionCase
+
+from .. import runbot_repo
+from ..runbot_build import (
+    badge_cache,
+    get_cache_generation,
+    get_gitlab_commit_state,
+    get_gitlab_status,
+    invalidate_repo_caches,
+    ref_cache,
+    status_cache,
+)
+from .test_outbound import WAIT, FakeSession
+
+
+class TestGitlabStatus(unittest2.TestCase):
+
+    def test_gitlab_status(self):
+        for state, result, status in [
+                ('pending', False, 'pending'),
+                ('testing', False, 'pending'),
+                ('running', 'ok', 'running'),
+                ('running', 'ko', 'failed'),
+                ('done', 'ok', 'success'),
+                ('done', 'warn', 'success'),
+                ('done', 'ko', 'failed'),
+                ('done', 'skipped', 'unknown'),
+                ('done', 'killed', 'unknown'),
+        ]:
+            self.assertEqual(get_gitlab_status(state, result), status,
+                             (state, result))
+
+    def test_gitlab_commit_state(self):
+        for state, result, commit_state in [
+                ('pending', False, 'pending'),
+                ('testing', False, 'running'),
+                ('running', 'ok', 'success'),
+                ('done', 'warn', 'success'),
+                ('done', 'ko', 'failed'),
+                ('done', 'skipped', 'canceled'),
+                ('done', 'killed', 'canceled'),
+                ('done', 'manually_killed', 'canceled'),
+        ]:
+            self.assertEqual(get_gitlab_commit_state(state, result),
+                             commit_state, (state, result))
+
+
+class TestInvalidateRepoCaches(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestInvalidateRepoCaches, self).setUp()
+        for cache in (status_cache, ref_cache, badge_cache):
+            cache.invalidate()
+        # Keys of controllers hold the repo id as routed, a string, or as
+        # an int once parsed
+        status_cache.set(('1', 'abc'), ('success', 'etag'))
+        status_cache.set(('2', 'abc'), ('failed', 'etag'))
+        ref_cache.set((1, 'master'), 7)
+        badge_cache.set((2, 'master'), ('success', '<svg/>', 'etag'))
+
+    def test_invalidate_repo(self):
+        generation = get_cache_generation(1)
+        other_generation = get_cache_generation('2')
+        invalidate_repo_caches('db', [1])
+        self.assertNotEqual(get_cache_generation('1'), generation)
+        self.assertEqual(get_cache_generation(2), other_generation)
+        self.assertIsNone(status_cache.get(('1', 'abc')))
+        self.assertIsNone(ref_cache.get((1, 'master')))
+        self.assertIsNotNone(status_cache.get(('2', 'abc')))
+        self.assertIsNotNone(badge_cache.get((2, 'master')))
+
+    def test_invalidate_all(self):
+        generations = get_cache_generation(1), get_cache_generation(2)
+        invalidate_repo_caches('db', None)
+        self.assertNotEqual(get_cache_generation(1), generations[0])
+        self.assertNotEqual(get_cache_generation(2), generations[1])
+        for cache in (status_cache, ref_cache, badge_cache):
+            self.assertEqual(len(cache), 0)
+
+
+class TestBuildStatusChanged(TransactionCase):
+
+    def setUp(self):
+        super(TestBuildStatusChanged, self).setUp()
+        repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+        })
+        branch = self.env['runbot.branch'].create({
+            'repo_id': repo.id,
+            'name': 'refs/heads/master',
+        })
+        self.build = self.env['runbot.build'].create({
+            'branch_id': branch.id,
+            'name': 'a' * 40,
+        })
+        self.repo_id = str(repo.id)
+
+    def test_status_changed(self):
+        """Statuses of a commit are dropped when its builds change"""
+        status_cache.set((self.repo_id, 'a' * 7), ('pending', 'etag'))
+        status_cache.set((self.repo_id, 'b' * 7), ('pending', 'etag'))
+        ref_cache.set((int(self.repo_id), 'master'), self.build.id)
+        self.build.write({'name': 'a' * 40})
+        self.assertIsNotNone(status_cache.get((self.repo_id, 'a' * 7)))
+        self.build.write({'state': 'testing'})
+        self.assertIsNone(status_cache.get((self.repo_id, 'a' * 7)))
+        self.assertIsNone(ref_cache.get((int(self.repo_id), 'master')))
+        self.assertIsNotNone(status_cache.get((self.repo_id, 'b' * 7)))
+
+
+class TestPublishStatus(TransactionCase):
+
+    def setUp(self):
+        super(TestPublishStatus, self).setUp()
+        for queue in (runbot_repo.outbound_queue, runbot_repo.status_queue):
+            self.addCleanup(setattr, queue, 'session', queue.session)
+            queue.session = FakeSession(201)
+        self.addCleanup(setattr, runbot_repo, 'STATUS_COALESCE_DELAY',
+                        runbot_repo.STATUS_COALESCE_DELAY)
+        runbot_repo.STATUS_COALESCE_DELAY = 0.2
+        repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'uses_gitlab': True,
+            'token': 'secret',
+            'gitlab_publish_status': True,
+        })
+        self.branch = self.env['runbot.branch'].create({
+            'repo_id': repo.id,
+            'name': 'refs/heads/master',
+        })
+
+    def test_publish_status(self):
+        """Statuses of a commit changing at once are published once"""
+        build = self.env['runbot.build'].create({
+            'branch_id': self.branch.id,
+            'name': 'a' * 40,
+        })
+        build.write({'state': 'testing'})
+        requests = runbot_repo.status_queue.session.requests
+        deadline = time.time() + WAIT
+        while not requests and time.time() < deadline:
+            time.sleep(0.01)
+        # Let a second request be sent if any
+        time.sleep(0.3)
+        self.assertEqual(len(requests), 1)
+        method, url, data = requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertTrue(url.endswith('/statuses/' + 'a' * 40))
+        self.assertEqual(data['state'], 'running')
+        self.assertTrue(data['target_url'].endswith(
+            '/runbot/build/%d' % build.id))
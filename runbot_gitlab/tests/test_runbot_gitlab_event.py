@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from gitlab3.exceptions import ResourceNotFound
+
+from openerp.tests import TransactionCase
+
+
+class FakeProject(object):
+
+    def __init__(self, project_id, merge_request_ids):
+        self.id = project_id
+        self.merge_request_ids = merge_request_ids
+
+    def merge_request(self, mr_id):
+        if mr_id not in self.merge_request_ids:
+            raise ResourceNotFound('404 Not Found')
+        return mr_id
+
+
+class TestRunbotGitlabEvent(TransactionCase):
+
+    def setUp(self):
+        super(TestRunbotGitlabEvent, self).setUp()
+        self.event_model = self.env['runbot.gitlab.event']
+        self.repo = self.env['runbot.repo'].create({
+            'name': 'http://gitlab.example.com/bench/runbot',
+        })
+
+    def merge_request_event(self, mr_id, state, project_id=1):
+        return self.event_model.create_from_hook(self.repo.id, {
+            'object_kind': 'merge_request',
+            'object_attributes': {
+                'id': mr_id,
+                'iid': mr_id + 100,
+                'target_project_id': project_id,
+                'source_branch': 'feature-%d' % mr_id,
+                'state': state,
+                'last_commit': {'id': 'a' * 40},
+            },
+        })
+
+    def test_create_from_hook(self):
+        event = self.merge_request_event(1, 'opened')
+        self.assertEqual(event.event_type, 'merge_request')
+        self.assertEqual(event.repo_id, self.repo)
+        self.assertEqual(event.project_id, 1)
+        self.assertEqual(event.merge_request_iid, 101)
+        self.assertEqual(event.ref, 'feature-1')
+        self.assertEqual(event.sha, 'a' * 40)
+        push = self.event_model.create_from_hook(self.repo.id, {
+            'object_kind': 'push',
+            'project_id': 1,
+            'ref': 'refs/heads/master',
+            'after': 'b' * 40,
+        })
+        self.assertEqual(push.event_type, 'push')
+        self.assertEqual(push.ref, 'refs/heads/master')
+        self.assertEqual(push.sha, 'b' * 40)
+
+    def test_create_from_hook_unhandled(self):
+        event = self.event_model.create_from_hook(self.repo.id, {
+            'object_kind': 'note',
+        })
+        self.assertFalse(event)
+
+    def test_get_merge_requests(self):
+        """Only the last event of each merge request counts"""
+        events = (self.merge_request_event(1, 'opened') |
+                  self.merge_request_event(2, 'opened') |
+                  self.merge_request_event(2, 'closed') |
+                  self.merge_request_event(3, 'closed') |
+                  self.merge_request_event(3, 'reopened'))
+        opened, closed = events.get_merge_requests(FakeProject(1, [1, 3]))
+        self.assertEqual(sorted(opened), [1, 3])
+        self.assertEqual(closed, [102])
+
+    def test_get_merge_requests_ignored(self):
+        """Events of other projects and unknown merge requests are
+        ignored"""
+        events = (self.merge_request_event(1, 'opened', project_id=2) |
+                  self.merge_request_event(2, 'opened'))
+        opened, closed = events.get_merge_requests(FakeProject(1, [1]))
+        self.assertEqual((opened, closed), ([], []))
@@ -0,0 +1,501 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Odoo, Open Source Management Solution
+#    This module copyright (C) 2010 Savoir-faire Linux
+#    (<http://www.savoirfairelinux.com>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import unittest2
+
+from openerp import fields
+from openerp.tests import TransactionCase
+
+from .. import runbot_repo
+from ..runbot_repo import (
+    ci_confs_lock,
+    get_commit_vals,
+    get_gitlab_params,
+    gitlab_map,
+    iter_merge_requests,
+    pending_ci_confs,
+    project_cache,
+    protected_branches_cache,
+)
+from .test_outbound import WAIT, FakeSession
+
+
+class FakeResource(object):
+    """Gitlab resource whose data is given as attributes"""
+
+    def __init__(self, **data):
+        self.__dict__.update(data)
+        self._data = data
+
+    def _get_data(self):
+        return self._data
+
+
+class FakeGitlabProject(FakeResource):
+    """Gitlab project serving the given branch heads and commits, counting
+    the commits asked"""
+
+    def __init__(self, heads=None, commits=None, protected=(), **data):
+        super(FakeGitlabProject, self).__init__(**data)
+        self.heads = heads or {}
+        self.commits = commits or {}
+        self.protected = protected
+        self.commit_calls = []
+
+    def find_branch(self, find_all=False, protected=None):
+        return [FakeResource(name=name, protected=True)
+                for name in self.protected]
+
+    def branch(self, name):
+        return FakeResource(name=name, commit={'id': self.heads[name]})
+
+    def commit(self, sha):
+        self.commit_calls.append(sha)
+        return FakeResource(**self.commits[sha])
+
+
+class FakeListingProject(object):
+    """Gitlab project listing merge requests most recently updated first,
+    repeating the last page past the end like some gitlab versions do"""
+
+    def __init__(self, merge_requests):
+        self._merge_requests = merge_requests
+        self.calls = []
+
+    def merge_requests(self, page, per_page, **params):
+        self.calls.append(dict(params, page=page))
+        pages = [self._merge_requests[i:i + per_page]
+                 for i in range(0, len(self._merge_requests), per_page)]
+        return pages[min(page, len(pages)) - 1] if pages else []
+
+
+def make_commit(sha, subject):
+    return {
+        'id': sha,
+        'author_name': 'Author',
+        'committer_name': 'Committer',
+        'message': subject,
+        'committed_date': datetime(2016, 1, 1, 12, 30),
+    }
+
+
+class TestGitlabFullSync(TransactionCase):
+
+    def setUp(self):
+        super(TestGitlabFullSync, self).setUp()
+        self.repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'gitlab_full_sync_interval': 60,
+        })
+
+    def test_polling(self):
+        """Repos without webhook poll gitlab on every update"""
+        self.repo.gitlab_last_full_sync = fields.Datetime.now()
+        self.assertTrue(self.repo._gitlab_full_sync_due())
+
+    def test_webhook(self):
+        """Repos with a webhook only poll gitlab once an interval"""
+        self.repo.gitlab_use_webhook = True
+        self.assertTrue(self.repo._gitlab_full_sync_due())
+        self.repo.gitlab_last_full_sync = fields.Datetime.to_string(
+            datetime.now() - timedelta(minutes=30))
+        self.assertFalse(self.repo._gitlab_full_sync_due())
+        self.repo.gitlab_last_full_sync = fields.Datetime.to_string(
+            datetime.now() - timedelta(minutes=61))
+        self.assertTrue(self.repo._gitlab_full_sync_due())
+
+
+class TestGitlabCIConf(TransactionCase):
+
+    def setUp(self):
+        super(TestGitlabCIConf, self).setUp()
+        self.session = runbot_repo.outbound_queue.session
+        runbot_repo.outbound_queue.session = FakeSession(201)
+
+    def tearDown(self):
+        runbot_repo.outbound_queue.session = self.session
+        super(TestGitlabCIConf, self).tearDown()
+
+    def create_repo(self):
+        return self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'uses_gitlab': True,
+            'token': 'secret',
+        })
+
+    def wait_pushed(self, repo):
+        """Wait for the callback of the push of the configuration"""
+        key = (self.cr.dbname, repo.id)
+        deadline = time.time() + WAIT
+        while time.time() < deadline:
+            with ci_confs_lock:
+                if key not in pending_ci_confs:
+                    return
+            time.sleep(0.01)
+        self.fail("The CI configuration of %s wasn't pushed" % repo.name)
+
+    def test_push_once(self):
+        """The configuration is saved by the update following its push"""
+        repo = self.create_repo()
+        self.wait_pushed(repo)
+        requests = runbot_repo.outbound_queue.session.requests
+        self.assertEqual(len(requests), 1)
+        method, url, data = requests[0]
+        self.assertEqual(method, 'PUT')
+        self.assertTrue(data['project_url'].endswith(
+            '/gitlab-ci/%d' % repo.id))
+        self.assertFalse(repo.gitlab_ci_conf_signature)
+        repo._gitlab_push_ci_conf()
+        self.assertTrue(repo.gitlab_ci_conf_signature)
+        repo._gitlab_push_ci_conf()
+        self.assertEqual(len(requests), 1)
+
+    def test_push_refused(self):
+        """Configurations refused by gitlab are pushed again"""
+        runbot_repo.outbound_queue.session = FakeSession(404, 201)
+        repo = self.create_repo()
+        self.wait_pushed(repo)
+        repo._gitlab_push_ci_conf()
+        self.assertFalse(repo.gitlab_ci_conf_signature)
+        self.wait_pushed(repo)
+        repo._gitlab_push_ci_conf()
+        self.assertTrue(repo.gitlab_ci_conf_signature)
+        self.assertEqual(
+            len(runbot_repo.outbound_queue.session.requests), 2)
+
+    def test_same_project(self):
+        """Repos of the same gitlab project are each configured"""
+        repos = self.create_repo() | self.create_repo()
+        for repo in repos:
+            self.wait_pushed(repo)
+        self.assertEqual(
+            len(runbot_repo.outbound_queue.session.requests), 2)
+        repos._gitlab_push_ci_conf()
+        self.assertTrue(all(repos.mapped('gitlab_ci_conf_signature')))
+
+
+class TestIterMergeRequests(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestIterMergeRequests, self).setUp()
+        self.page_size = runbot_repo.MR_PAGE_SIZE
+        runbot_repo.MR_PAGE_SIZE = 2
+        self.now = datetime(2016, 1, 1)
+        self.project = FakeListingProject([
+            FakeResource(id=mr_id,
+                         updated_at=self.now - timedelta(hours=mr_id))
+            for mr_id in range(1, 6)
+        ])
+
+    def tearDown(self):
+        runbot_repo.MR_PAGE_SIZE = self.page_size
+        super(TestIterMergeRequests, self).tearDown()
+
+    def test_all_pages(self):
+        mrs = list(iter_merge_requests(self.project))
+        self.assertEqual([mr.id for mr in mrs], [1, 2, 3, 4, 5])
+        self.assertEqual([call['page'] for call in self.project.calls],
+                         [1, 2, 3])
+        self.assertEqual(self.project.calls[0]['order_by'], 'updated_at')
+        self.assertEqual(self.project.calls[0]['sort'], 'desc')
+
+    def test_repeated_last_page(self):
+        """A full last page repeated by gitlab ends the stream"""
+        del self.project._merge_requests[-1]
+        mrs = list(iter_merge_requests(self.project))
+        self.assertEqual([mr.id for mr in mrs], [1, 2, 3, 4])
+        self.assertEqual(len(self.project.calls), 3)
+
+    def test_shifted_pages(self):
+        """A merge request updated while pages are read shifts the next
+        pages, which doesn't end the stream"""
+        mrs = []
+        for mr in iter_merge_requests(self.project):
+            mrs.append(mr.id)
+            if mr.id == 2:
+                merge_requests = self.project._merge_requests
+                merge_requests.insert(0, merge_requests.pop(3))
+        self.assertEqual(mrs, [1, 2, 3, 5])
+
+    def test_updated_after(self):
+        """The stream stops at the first merge request updated before the
+        cursor, without asking the following pages"""
+        updated_after = self.now - timedelta(hours=2, minutes=30)
+        mrs = list(iter_merge_requests(self.project, updated_after))
+        self.assertEqual([mr.id for mr in mrs], [1, 2])
+        self.assertEqual(len(self.project.calls), 2)
+        self.assertEqual(self.project.calls[0]['updated_after'],
+                         updated_after.isoformat())
+
+
+class TestGitlabMap(unittest2.TestCase):
+
+    def test_gitlab_map(self):
+        threads = set()
+
+        def func(item):
+            threads.add(threading.current_thread())
+            # Later items finish first
+            time.sleep((5 - item) * 0.01)
+            return item * 2
+
+        self.assertEqual(gitlab_map(func, range(5), 3), [0, 2, 4, 6, 8])
+        self.assertLessEqual(len(threads), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+        threads.clear()
+        self.assertEqual(gitlab_map(func, range(5), 1), [0, 2, 4, 6, 8])
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+
+class TestGetCommitVals(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestGetCommitVals, self).setUp()
+        self.commit = make_commit('a' * 40, 'Fix things')
+
+    def test_commit_vals(self):
+        self.assertEqual(get_commit_vals(self.commit), {
+            'author': 'Author',
+            'committer': 'Committer',
+            'subject': 'Fix things',
+            'date': '2016-01-01 12:30:00',
+        })
+
+    def test_old_gitlab(self):
+        del self.commit['author_name']
+        del self.commit['committer_name']
+        self.commit['author'] = {'name': 'Author'}
+        self.commit['committer'] = {'name': 'Committer'}
+        vals = get_commit_vals(self.commit)
+        self.assertEqual((vals['author'], vals['committer']),
+                         ('Author', 'Committer'))
+
+    def test_no_committer(self):
+        del self.commit['committer_name']
+        self.assertEqual(get_commit_vals(self.commit)['committer'], 'Author')
+
+
+class TestGitlabSyncMergeRequests(TransactionCase):
+
+    def setUp(self):
+        super(TestGitlabSyncMergeRequests, self).setUp()
+        # Nothing listens on port 1, the requests queued for gitlab are
+        # given up in the background
+        self.repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'uses_gitlab': True,
+            'token': 'secret',
+        })
+        self.shas = ['a' * 40, 'b' * 40, 'c' * 40]
+        self.project = FakeGitlabProject(
+            id=1,
+            path_with_namespace='bench/runbot',
+            default_branch='master',
+            protected=['release'],
+            commits=dict(
+                (sha, make_commit(sha, 'Commit %d' % i))
+                for i, sha in enumerate(self.shas)
+            ),
+        )
+        # A fork, source of merge requests
+        self.fork = FakeGitlabProject(
+            id=2,
+            path_with_namespace='fork/runbot',
+            default_branch='master',
+            heads={'feature-3': self.shas[2]},
+            commits=self.project.commits,
+        )
+        domain, _ = get_gitlab_params(self.repo.base)
+        for project in (self.project, self.fork):
+            project_cache.set((domain, 'secret', project.id), project)
+
+    def tearDown(self):
+        project_cache.invalidate()
+        protected_branches_cache.invalidate()
+        super(TestGitlabSyncMergeRequests, self).tearDown()
+
+    def make_mr(self, iid, sha=None, source_project_id=1):
+        mr = FakeResource(
+            id=iid + 100,
+            iid=iid,
+            title='Feature %d' % iid,
+            source_project_id=source_project_id,
+            source_branch='feature-%d' % iid,
+        )
+        if sha:
+            mr.sha = sha
+        return mr
+
+    def get_builds(self):
+        return self.env['runbot.build'].search(
+            [('repo_id', '=', self.repo.id)], order='id')
+
+    def test_heads_from_listing(self):
+        """Commits of heads are only asked once to gitlab"""
+        self.repo._gitlab_sync_merge_requests(self.project, [
+            self.make_mr(1, self.shas[0]),
+            self.make_mr(2, self.shas[0]),
+        ])
+        builds = self.get_builds()
+        self.assertEqual(builds.mapped('name'), [self.shas[0]] * 2)
+        self.assertEqual(builds.mapped('subject'), ['Commit 0'] * 2)
+        self.assertEqual(builds.mapped('branch_id.merge_request_id'),
+                         [1, 2])
+        self.assertEqual(self.project.commit_calls, [self.shas[0]])
+
+    def test_known_commit(self):
+        """Commits already built in the repo aren't asked to gitlab"""
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(1, self.shas[1])])
+        self.project.commit_calls = []
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(2, self.shas[1])])
+        self.assertEqual(self.project.commit_calls, [])
+        self.assertEqual(self.get_builds().mapped('subject'),
+                         ['Commit 1'] * 2)
+
+    def test_heads_of_older_gitlab(self):
+        """Without head in the listing, it is read from the source branch"""
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(3, source_project_id=2)])
+        build = self.get_builds()
+        self.assertEqual(build.name, self.shas[2])
+        self.assertEqual(build.subject, 'Commit 2')
+        self.assertEqual(self.fork.commit_calls, [self.shas[2]])
+
+    def test_existing_branches_and_builds(self):
+        """Known branches are reused and built heads aren't built again"""
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(1, self.shas[0])])
+        branches = self.env['runbot.branch'].search(
+            [('repo_id', '=', self.repo.id)])
+        self.repo._gitlab_sync_merge_requests(self.project, [
+            self.make_mr(1, self.shas[0]),
+            self.make_mr(1, self.shas[0]),
+        ])
+        self.assertEqual(len(self.get_builds()), 1)
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(1, self.shas[1])])
+        self.assertEqual(self.get_builds().mapped('name'), self.shas[:2])
+        self.assertEqual(
+            self.env['runbot.branch'].search(
+                [('repo_id', '=', self.repo.id)]),
+            branches)
+
+    def test_branches_by_project(self):
+        """Merge requests of the same number in another project are other
+        branches"""
+        self.repo._gitlab_sync_merge_requests(
+            self.project, [self.make_mr(1, self.shas[0])])
+        self.repo._gitlab_sync_merge_requests(
+            self.fork, [self.make_mr(1, self.shas[0])])
+        branches = self.env['runbot.branch'].search(
+            [('repo_id', '=', self.repo.id)])
+        self.assertEqual(sorted(branches.mapped('project_id')), [1, 2])
+        self.assertEqual(len(self.get_builds()), 2)
+
+    def test_concurrency(self):
+        icp = self.env['ir.config_parameter']
+        icp.set_param('runbot_gitlab.concurrency', '2')
+        self.assertEqual(self.repo._gitlab_concurrency(), 2)
+        icp.set_param('runbot_gitlab.concurrency.localhost:1', '4')
+        self.assertEqual(self.repo._gitlab_concurrency(), 4)
+        self.repo._gitlab_sync_merge_requests(self.project, [
+            self.make_mr(1, self.shas[0]),
+            self.make_mr(2, self.shas[1]),
+            self.make_mr(3, source_project_id=2),
+        ])
+        builds = self.get_builds()
+        self.assertEqual(
+            sorted(zip(builds.mapped('branch_id.merge_request_id'),
+                       builds.mapped('subject'))),
+            [(1, 'Commit 0'), (2, 'Commit 1'), (3, 'Commit 2')])
+
+    def test_clean_merge_requests(self):
+        """Branches of closed merge requests of the project are removed
+        with their builds"""
+        self.repo._gitlab_sync_merge_requests(self.project, [
+            self.make_mr(1, self.shas[0]),
+            self.make_mr(2, self.shas[1]),
+        ])
+        self.repo._gitlab_sync_merge_requests(
+            self.fork, [self.make_mr(1, self.shas[2])])
+        self.repo._gitlab_clean_merge_requests(self.project, [])
+        self.assertEqual(len(self.get_builds()), 3)
+        self.repo._gitlab_clean_merge_requests(self.project, [1, 3])
+        branches = self.env['runbot.branch'].search(
+            [('repo_id', '=', self.repo.id)])
+        self.assertEqual(
+            sorted((b.project_id, b.merge_request_id) for b in branches),
+            [(1, 2), (2, 1)])
+        self.assertEqual(sorted(self.get_builds().mapped('name')),
+                         self.shas[1:])
+
+    def make_branch(self, name, **vals):
+        vals.update({
+            'repo_id': self.repo.id,
+            'name': name,
+        })
+        return self.env['runbot.branch'].create(vals)
+
+    def test_stick_protected_branches(self):
+        """Default and protected branches are sticky"""
+        master = self.make_branch('refs/heads/master')
+        release = self.make_branch('refs/heads/release')
+        feature = self.make_branch('refs/heads/feature')
+        self.repo._gitlab_stick_protected_branches(self.project)
+        self.assertTrue(master.sticky)
+        self.assertTrue(release.sticky)
+        self.assertFalse(feature.sticky)
+
+    def test_skip_pending_builds(self):
+        """Pending builds of branches which are neither sticky nor merge
+        requests are skipped"""
+        build_model = self.env['runbot.build']
+        builds = {}
+        for name, vals in [('refs/heads/master', {'sticky': True}),
+                           ('refs/heads/feature', {}),
+                           ('Feature', {'project_id': 1,
+                                        'merge_request_id': 1})]:
+            branch = self.make_branch(name, **vals)
+            builds[name] = build_model.create({
+                'branch_id': branch.id,
+                'name': self.shas[0],
+            })
+        done = build_model.create({
+            'branch_id': builds['refs/heads/feature'].branch_id.id,
+            'name': self.shas[1],
+            'state': 'done',
+            'result': 'ok',
+        })
+        self.repo._gitlab_skip_pending_builds()
+        self.assertEqual(
+            (builds['refs/heads/feature'].state,
+             builds['refs/heads/feature'].result),
+            ('done', 'skipped'))
+        self.assertEqual(builds['refs/heads/master'].state, 'pending')
+        self.assertEqual(builds['Feature'].state, 'pending')
+        self.assertEqual(done.result, 'ok')
@@ -13,17 +13,160 @@ This module is used to create new fields in the inherited classes
 to work with pylint from runbot
 """
 
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import pipes
+import shutil
 import stat
+import subprocess
+import time
 from itertools import ifilter, imap
 
 from openerp import api, fields, models
 from openerp.tools.safe_eval import safe_eval
 
+_logger = logging.getLogger(__name__)
 
 # Max number of lines to create logs in database
 MAX_LOG_LINES = 20
 
+# Default number of builds runbot runs at once, see runbot.workers
+RUNBOT_WORKERS = 6
+
+# Default size of the cache of pylint results in MB,
+# see runbot_pylint.cache_size
+PYLINT_CACHE_SIZE = 1024
+
+# Min seconds between two sweeps of the cache of pylint results, and file
+# of the cache whose mtime is the time of the last one, see
+# clean_pylint_cache
+PYLINT_CACHE_CLEAN_INTERVAL = 600
+PYLINT_CACHE_CLEAN_MARKER = '.last_clean'
+
+# pylint exit status from which its output isn't cached: usage error or
+# killed by a signal
+PYLINT_STATUS_NO_CACHE = 32
+
+# Version of the pylint of the PATH, see get_pylint_version
+_pylint_version = []
+
+# Max number of manifests parsed kept in memory
+MANIFEST_CACHE_SIZE = 4096
+
+# Depends of manifests by sha1 of their content, see get_manifest_depends
+_manifest_depends = {}
+
+
+def get_pylint_version():
+    """
+    Get the version of pylint run by the builds, which is part of the keys
+    of the cache of pylint results
+    :return str: output of pylint --version
+    """
+    if not _pylint_version:
+        try:
+            version = subprocess.check_output(['pylint', '--version'],
+                                              stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            version = ''
+        _pylint_version.append(version)
+    return _pylint_version[0]
+
+
+def get_pylint_status(log_dir, module):
+    """
+    Get the exit status of the pylint run of a module
+    :param str log_dir: directory of the pylint logs of a build
+    :param str module: name of the module
+    :return int: exit status, None if pylint didn't finish or its log is
+        missing
+    """
+    if not os.path.isfile(os.path.join(log_dir, module + '.txt')):
+        return None
+    try:
+        with open(os.path.join(log_dir, module + '.status')) as f_status:
+            return int(f_status.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def get_pylint_cache_path(cache_dir, key):
+    """
+    Get the path of the pylint result of a key in the cache
+    """
+    return os.path.join(cache_dir, key[:2], key + '.txt')
+
+
+def clean_pylint_cache(cache_dir, max_size):
+    """
+    Remove the least recently used results of the cache until it is
+    smaller than max_size. Results are touched when reused, so the least
+    recently used are the ones with the oldest mtime.
+    The cache is swept at most once every PYLINT_CACHE_CLEAN_INTERVAL
+    seconds by all builds, as walking it stats every result.
+    :param str cache_dir: path of the cache
+    :param int max_size: max size of the cache in bytes
+    :return bool: True if the cache was swept
+    """
+    marker = os.path.join(cache_dir, PYLINT_CACHE_CLEAN_MARKER)
+    try:
+        if time.time() - os.stat(marker).st_mtime < \
+           PYLINT_CACHE_CLEAN_INTERVAL:
+            return False
+    except OSError:
+        # Never swept
+        pass
+    # Touch the marker first, so builds storing results meanwhile don't
+    # sweep it too
+    with open(marker, 'a'):
+        os.utime(marker, None)
+    entries = []
+    size = 0
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if path == marker:
+                continue
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                # Removed by another build
+                continue
+            entries.append((path_stat.st_mtime, path_stat.st_size, path))
+            size += path_stat.st_size
+    entries.sort()
+    for _, entry_size, path in entries:
+        if size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        size -= entry_size
+    return True
+
+
+def get_manifest_depends(manifest_filename):
+    """
+    Get depends of a manifest, parsed once by content of manifest, so
+    manifests identical in several builds are only evaluated once
+    :param str manifest_filename: path of __openerp__.py
+    :return tuple: names of the modules depended upon
+    """
+    with open(manifest_filename) as f_manifest:
+        manifest_str = f_manifest.read()
+    key = hashlib.sha1(manifest_str).hexdigest()
+    depends = _manifest_depends.get(key)
+    if depends is None:
+        if len(_manifest_depends) >= MANIFEST_CACHE_SIZE:
+            _manifest_depends.clear()
+        depends = tuple(safe_eval(manifest_str).get('depends', []))
+        _manifest_depends[key] = depends
+    return depends
+
 
 def get_depends(modules, addons_paths):
     """
@@ -34,8 +177,11 @@ def get_depends(modules, addons_paths):
     """
     modules = set(map(
         lambda mystr: mystr.strip(), (modules or '').split(",")))
-    addons_paths = set(map(
-        lambda mystr: mystr.strip(), (addons_paths or '').split(',')))
+    addons_paths = map(
+        lambda mystr: mystr.strip(), (addons_paths or '').split(','))
+    # Remove duplicated paths, keeping the order of search
+    addons_paths = [path for i, path in enumerate(addons_paths)
+                    if path not in addons_paths[:i]]
     visited = set()
     while modules != visited:
         module = (modules - visited).pop()
@@ -49,11 +195,24 @@ def get_depends(modules, addons_paths):
         except StopIteration:
             # For some reason the module wasn't found
             continue
-        manifest = safe_eval(open(manifest_filename).read())
-        modules.update(manifest.get('depends', []))
+        modules.update(get_manifest_depends(manifest_filename))
     return modules
 
 
+def get_path_module(path):
+    """
+    Get the module of a path relative to the root of a repo
+    :param str path: path of a file of a repo
+    :return str: name of the module, None if the path isn't in a module
+    """
+    parts = path.split('/')
+    if parts[:2] == ['openerp', 'addons']:
+        parts = parts[2:]
+    elif parts[0] == 'addons':
+        parts = parts[1:]
+    return parts[0] if len(parts) > 1 else None
+
+
 class RunbotBuild(models.Model):
 
     """
@@ -127,6 +286,178 @@ class RunbotBuild(models.Model):
             modules_to_check_pylint = list(depends & modules_to_check_pylint)
         return modules_to_check_pylint
 
+    @api.model
+    def get_pylint_jobs(self):
+        """
+        Number of pylint processes run at once by a build.
+        It is the share of the cpus of a build: cpus divided by the number
+        of builds runbot runs at once, unless the runbot_pylint.jobs
+        parameter is set.
+        :return int: number of processes
+        """
+        icp = self.env['ir.config_parameter']
+        jobs = icp.get_param('runbot_pylint.jobs')
+        if not jobs:
+            workers = int(icp.get_param('runbot.workers',
+                                        default=RUNBOT_WORKERS))
+            jobs = multiprocessing.cpu_count() // max(workers, 1)
+        return max(int(jobs), 1)
+
+    @api.multi
+    def get_pylint_baseline(self):
+        """
+        Get the build whose pylint results can be reused by this build:
+        the last build of the sticky branch of the repo closest to this
+        build, i.e. with the fewest commits of this build since their merge
+        base, checked with the same pylint configuration.
+        Reused results are the ones of modules with the same tree in both
+        commits, so the modules changed are diffed from the commit of the
+        baseline build, not from the merge base.
+        Only modules of the repo of the build can be reused: the branches
+        of dependency repos are not pinned to a commit.
+        :return tuple: baseline build and set of modules whose results can
+            be reused, (None, None) if there is no baseline
+        """
+        self.ensure_one()
+        if self.branch_id.sticky:
+            return None, None
+        baseline, baseline_distance = None, None
+        sticky_branches = self.env['runbot.branch'].search([
+            ('repo_id', '=', self.repo_id.id),
+            ('sticky', '=', True),
+        ])
+        for branch in sticky_branches:
+            target = self.search([
+                ('branch_id', '=', branch.id),
+                ('state', 'in', ['running', 'done']),
+                ('result', 'not in', ['skipped', 'killed',
+                                      'manually_killed']),
+                ('pylint_conf_path', '=', self.pylint_conf_path),
+            ], order='id desc', limit=1)
+            if not target or \
+               not os.path.isdir(target.path('logs', 'pylint')):
+                continue
+            distance = self.repo_id.get_merge_base_distance(
+                target.name, self.name)
+            if distance is not None and \
+               (baseline_distance is None or distance < baseline_distance):
+                baseline, baseline_distance = target, distance
+        if baseline is None:
+            return None, None
+        changed_paths = self.repo_id.get_changed_paths(
+            baseline.name, self.name)
+        conf_path = os.path.normpath(self.pylint_conf_path)
+        if any(conf_path == path or conf_path.endswith('/' + path)
+               for path in changed_paths):
+            # pylint configuration changed, no result can be reused
+            return None, None
+        changed_modules = set(
+            ifilter(None, imap(get_path_module, changed_paths)))
+        reusable_modules = set(self.repo_id.get_module_list(self.name))
+        # Modules of dependency repos are never reused, even when a module
+        # of the same name exists in the repo of the build
+        repo_branch_name_data = self.get_repo_branch_name()
+        for repo_id in repo_branch_name_data:
+            repo = self.env['runbot.repo'].browse(repo_id)
+            if repo != self.repo_id and repo.check_pylint:
+                reusable_modules -= set(repo.get_module_list(
+                    repo_branch_name_data[repo_id]))
+        return baseline, reusable_modules - changed_modules
+
+    @api.model
+    def get_pylint_cache_size(self):
+        """
+        Get the maximum size in MB of the cache of pylint results from
+        runbot_pylint.cache_size, the default one if it isn't a number
+        """
+        cache_size = self.env['ir.config_parameter'].get_param(
+            'runbot_pylint.cache_size', default=PYLINT_CACHE_SIZE)
+        try:
+            return int(cache_size)
+        except (TypeError, ValueError):
+            _logger.warning('Invalid runbot_pylint.cache_size %r, using '
+                            '%d MB', cache_size, PYLINT_CACHE_SIZE)
+            return PYLINT_CACHE_SIZE
+
+    @api.model
+    def get_pylint_cache_dir(self):
+        """
+        Get the directory of the cache of pylint results, shared by the
+        builds of all repos, None if the cache is disabled
+        """
+        if not self.get_pylint_cache_size():
+            return None
+        return os.path.join(self.env['runbot.repo'].root(), 'pylint_cache')
+
+    @api.multi
+    def get_pylint_cache_keys(self, modules, path_pylint_conf):
+        """
+        Get the keys of the pylint results of modules in the cache:
+        the git tree sha of the module, the sha1 of the pylint
+        configuration file and the version of pylint.
+        return dict {module name: key}, without the modules whose tree
+        wasn't found
+        """
+        self.ensure_one()
+        repo_pool = self.env['runbot.repo']
+        module_trees = {}
+        repo_branch_name_data = self.get_repo_branch_name()
+        for repo_id in repo_branch_name_data:
+            repo = repo_pool.browse(repo_id)
+            if repo.check_pylint:
+                module_trees.update(repo.get_module_trees(
+                    repo_branch_name_data[repo_id]))
+        with open(path_pylint_conf) as f_pylint_conf:
+            conf_sha = hashlib.sha1(f_pylint_conf.read()).hexdigest()
+        version_sha = hashlib.sha1(get_pylint_version()).hexdigest()
+        return dict(
+            (module, hashlib.sha1('%s-%s-%s' % (
+                module_trees[module], conf_sha, version_sha)).hexdigest())
+            for module in modules if module in module_trees)
+
+    @api.multi
+    def store_pylint_cache(self):
+        """
+        Store in the cache the pylint results of the modules checked by
+        the build, then evict the least recently used results above
+        runbot_pylint.cache_size MB
+        """
+        cache_dir = self.get_pylint_cache_dir()
+        if not cache_dir:
+            return
+        stored = False
+        for build in self:
+            fname_keys = build.path('logs', 'pylint', 'cache_keys.json')
+            if not os.path.isfile(fname_keys):
+                continue
+            with open(fname_keys) as f_keys:
+                try:
+                    cache_keys = json.load(f_keys)
+                except ValueError:
+                    _logger.warning('Invalid pylint cache keys %s',
+                                    fname_keys)
+                    continue
+            pylint_log_dir = build.path('logs', 'pylint')
+            for module, key in cache_keys.items():
+                status = get_pylint_status(pylint_log_dir, module)
+                if status is None or status >= PYLINT_STATUS_NO_CACHE:
+                    continue
+                cache_path = get_pylint_cache_path(cache_dir, key)
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path))
+                # Copy then rename so others never read partial results,
+                # the log last as it is the one looked up first
+                for ext in ('.status', '.txt'):
+                    entry_path = cache_path[:-len('.txt')] + ext
+                    tmp_path = '%s.%d.tmp' % (entry_path, os.getpid())
+                    shutil.copyfile(
+                        os.path.join(pylint_log_dir, module + ext), tmp_path)
+                    os.rename(tmp_path, entry_path)
+                stored = True
+        if stored:
+            clean_pylint_cache(
+                cache_dir, self.get_pylint_cache_size() * 1024 * 1024)
+
     def job_15_pylint(self, cr, uid, build, lock_path, log_path, args=None):
         """
         This method is used to run pylint test, getting parameters of the
@@ -138,6 +469,19 @@ class RunbotBuild(models.Model):
         :param log_path: path of log file, this parameter is string, where are
                             has saved the log of test.
         :param args: this parameter not is required, not is used.
+
+        In the parallel run mode of the repo, modules are checked by a pool
+        of get_pylint_jobs processes, each one logging in
+        logs/pylint/<module>.txt, then these logs are merged in the log of
+        the job in the order of the modules.
+        In the single run mode, all modules are checked by one pylint
+        process, sharing the astroid cache of the modules they import.
+        With pylint_incremental checked on the repo, the logs of the modules
+        not changed since the build of get_pylint_baseline are copied from
+        this build instead of checking these modules.
+        Then the logs of the modules found in the cache of pylint results
+        are copied from it, the keys of the other modules are saved for
+        job_30_run to store their results in the cache.
         """
         if args is None:
             args = {}
@@ -157,6 +501,62 @@ class RunbotBuild(models.Model):
         if not modules_to_check_pylint:
             build._log('pylint_script', 'No modules to check pylint found')
             return None
+        pylint_jobs = build.get_pylint_jobs()
+        pylint_log_dir = build.path('logs', 'pylint')
+        if not os.path.isdir(pylint_log_dir):
+            os.makedirs(pylint_log_dir)
+        modules_reused = []
+        if build.repo_id.pylint_incremental:
+            baseline, reusable_modules = build.get_pylint_baseline()
+            for module in modules_to_check_pylint:
+                if baseline is None or module not in reusable_modules:
+                    continue
+                baseline_log_dir = baseline.path('logs', 'pylint')
+                # Don't reuse logs of pylint runs cut short
+                status = get_pylint_status(baseline_log_dir, module)
+                if status is None or status >= PYLINT_STATUS_NO_CACHE:
+                    continue
+                for ext in ('.txt', '.status'):
+                    shutil.copyfile(
+                        os.path.join(baseline_log_dir, module + ext),
+                        os.path.join(pylint_log_dir, module + ext))
+                modules_reused.append(module)
+            if modules_reused:
+                build._log('pylint_script',
+                           'Reused pylint results of build %s for %d '
+                           'modules' % (baseline.dest, len(modules_reused)))
+        cache_dir = build.get_pylint_cache_dir()
+        if cache_dir:
+            cache_keys = build.get_pylint_cache_keys(
+                [module for module in modules_to_check_pylint
+                 if module not in modules_reused],
+                path_pylint_conf)
+            modules_cached = []
+            for module, key in cache_keys.items():
+                cache_path = get_pylint_cache_path(cache_dir, key)
+                try:
+                    # The status lets later builds reuse the result too
+                    for ext in ('.txt', '.status'):
+                        shutil.copyfile(
+                            cache_path[:-len('.txt')] + ext,
+                            os.path.join(pylint_log_dir, module + ext))
+                        # Mark as recently used for clean_pylint_cache
+                        os.utime(cache_path[:-len('.txt')] + ext, None)
+                except (IOError, OSError):
+                    continue
+                modules_cached.append(module)
+                del cache_keys[module]
+            if modules_cached:
+                build._log('pylint_script',
+                           'Reused cached pylint results for %d modules' %
+                           len(modules_cached))
+                modules_reused.extend(modules_cached)
+            with open(os.path.join(pylint_log_dir, 'cache_keys.json'),
+                      'w') as f_keys:
+                json.dump(cache_keys, f_keys)
+        modules_to_run_pylint = [module
+                                 for module in modules_to_check_pylint
+                                 if module not in modules_reused]
         fname_pylint_run_sh = os.path.join(build.path(),
                                            'pylint_run.sh')
         with open(fname_pylint_run_sh, "w") as f_pylint_run_sh:
@@ -164,11 +564,42 @@ class RunbotBuild(models.Model):
             f_pylint_run_sh.write("export PYTHONPATH="
                                   "$PYTHONPATH:%s\n" %
                                   (build.server()))
-            for module_to_check_pylint in modules_to_check_pylint:
-                cmd = "pylint --rcfile=%s %s" % \
-                      (path_pylint_conf,
-                       os.path.join(build.server('addons'),
-                                    module_to_check_pylint))
+            if not modules_to_run_pylint:
+                # Every result was reused
+                pass
+            elif build.repo_id.pylint_run_mode == 'single':
+                cmd = "pylint --rcfile=%s %s" % (
+                    pipes.quote(path_pylint_conf),
+                    ' '.join(
+                        pipes.quote(os.path.join(build.server('addons'),
+                                                 module))
+                        for module in modules_to_run_pylint))
+                f_pylint_run_sh.write(cmd + '\n')
+            else:
+                # xargs runs pylint_jobs pylint at once, replacing {} by
+                # each module, which is $4 in the command of sh. The exit
+                # status of pylint tells job_30_run whether to cache its log
+                cmd = "printf '%%s\\n' %s | xargs -P %d -I{} sh -c " \
+                      "'pylint --rcfile=\"$1\" \"$2/$4\" " \
+                      "> \"$3/$4.txt\" 2>&1; echo $? > \"$3/$4.status\"' " \
+                      "pylint %s %s %s {}" % (
+                          ' '.join(imap(pipes.quote,
+                                        modules_to_run_pylint)),
+                          pylint_jobs,
+                          pipes.quote(path_pylint_conf),
+                          pipes.quote(build.server('addons')),
+                          pipes.quote(pylint_log_dir))
+                f_pylint_run_sh.write(cmd + '\n')
+            # Merge the logs of modules in the log of the job, only the
+            # reused ones in single run mode which logs in it directly
+            if build.repo_id.pylint_run_mode == 'single':
+                modules_logged = modules_reused
+            else:
+                modules_logged = modules_to_check_pylint
+            if modules_logged:
+                cmd = "cat %s" % ' '.join(
+                    pipes.quote(os.path.join(pylint_log_dir, module + '.txt'))
+                    for module in modules_logged)
                 f_pylint_run_sh.write(cmd + '\n')
 
             # TODO: Add check pdb and print sentence check in
@@ -194,6 +625,11 @@ class RunbotBuild(models.Model):
         """
         res = super(RunbotBuild, self).job_30_run(
             cr, uid, build, lock_path, log_path)
+        try:
+            build.store_pylint_cache()
+        except (IOError, OSError, ValueError):
+            _logger.exception('Could not store pylint results of build %s '
+                              'in cache', build.dest)
         pylint_log = build.path('logs', 'job_15_pylint.txt')
         count = 0
         if not os.path.isfile(pylint_log):
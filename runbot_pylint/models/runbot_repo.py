@@ -14,6 +14,7 @@ to work with pylint from runbot
 """
 
 import os
+import subprocess
 
 from openerp import api, fields, models
 
@@ -32,6 +33,17 @@ class RunbotRepo(models.Model):
         help='Relative path to pylint conf file')
     check_pylint = fields.Boolean(
         help='Check pylint to modules of this repo')
+    pylint_run_mode = fields.Selection(
+        [('parallel', 'One process by module'),
+         ('single', 'Single process')],
+        default='parallel', required=True,
+        help='Check modules with one pylint process by module, run in '
+             'parallel, or with a single pylint process for all modules, '
+             'parsing the modules they import only once')
+    pylint_incremental = fields.Boolean(
+        help='Check pylint only to modules changed from the last build of '
+             'the closest sticky branch and reuse its pylint results for '
+             'the other modules')
 
     @api.multi
     def get_module_list(self, treeish):
@@ -52,3 +64,61 @@ class RunbotRepo(models.Model):
             repo_paths_list = [os.path.basename(module)
                                for module in repo_paths_list]
         return repo_paths_list
+
+    @api.multi
+    def get_module_trees(self, treeish):
+        """
+        Get git tree sha of the modules of a repo with a treeish
+        (sha, tag or branch name)
+        return dict {module name: tree sha}
+        """
+        module_trees = {}
+        for repo in self:
+            command_git = ['ls-tree', treeish]
+            # get addons trees from main repo
+            repo_trees_str = repo.git(command_git +
+                                      ['addons/', 'openerp/addons/'])
+            if not repo_trees_str:
+                # get addons trees from module repo
+                repo_trees_str = repo.git(command_git)
+            for line in (repo_trees_str or '').splitlines():
+                # <mode> SP <type> SP <sha> TAB <path>
+                info, path = line.split('\t', 1)
+                obj_type, sha = info.split()[1:3]
+                if obj_type == 'tree':
+                    module_trees[os.path.basename(path)] = sha
+        return module_trees
+
+    @api.multi
+    def get_changed_paths(self, treeish_from, treeish_to):
+        """
+        Get paths of files changed between two treeish of a repo
+        """
+        changed_paths = []
+        for repo in self:
+            paths_str = repo.git(['diff', '--name-only',
+                                  treeish_from, treeish_to])
+            changed_paths = paths_str and\
+                paths_str.rstrip().split('\n') or []
+        return changed_paths
+
+    @api.multi
+    def get_merge_base_distance(self, treeish_from, treeish_to):
+        """
+        Get number of commits of treeish_to since its merge base with
+        treeish_from, None if they have no common ancestor
+        """
+        distance = None
+        for repo in self:
+            try:
+                merge_base = repo.git(['merge-base', treeish_from,
+                                       treeish_to])
+            except subprocess.CalledProcessError:
+                # No common ancestor or unknown treeish
+                continue
+            if not merge_base or not merge_base.strip():
+                continue
+            count = repo.git(['rev-list', '--count', '%s..%s' % (
+                merge_base.strip(), treeish_to)])
+            distance = int(count.strip())
+        return distance
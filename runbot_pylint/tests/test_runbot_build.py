@@ -0,0 +1,481 @@
+# -*- encoding: utf-8 -*-
+##############################################################
+#    Module Writen For Odoo, Open Source Management Solution
+#
+#    Copyright (c) 2011 Vauxoo - http://www.vauxoo.com
+#    All Rights Reserved.
+#    info Vauxoo (info@vauxoo.com)
+#    coded by: moylop260@vauxoo.com
+############################################################################
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import unittest2
+
+from openerp.tests import TransactionCase
+
+from ..models import runbot_build
+from ..models.runbot_build import (
+    clean_pylint_cache,
+    get_depends,
+    get_path_module,
+    get_pylint_cache_path,
+    get_pylint_status,
+)
+
+# pylint printing its arguments, with the exit status of a convention
+# message, run by the scripts of job_15_pylint
+FAKE_PYLINT = """#!/bin/sh
+echo "$@"
+exit 16
+"""
+
+
+class PylintBuildCase(TransactionCase):
+
+    def setUp(self):
+        super(PylintBuildCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.bin_dir = os.path.join(self.root, 'bin')
+        os.makedirs(self.bin_dir)
+        fname_pylint = os.path.join(self.bin_dir, 'pylint')
+        with open(fname_pylint, 'w') as f_pylint:
+            f_pylint.write(FAKE_PYLINT)
+        os.chmod(fname_pylint, 0o755)
+        icp = self.env['ir.config_parameter']
+        icp.set_param('runbot_pylint.jobs', '3')
+        # The cache of pylint results is disabled unless a test sets a size
+        icp.set_param('runbot_pylint.cache_size', '0')
+        self.repo = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/runbot',
+            'check_pylint': True,
+            'pylint_conf_path': '.pylintrc',
+        })
+        self.branch = self.env['runbot.branch'].create({
+            'repo_id': self.repo.id,
+            'name': 'refs/heads/master',
+        })
+        self.spawned = []
+        self.modules = ['sale', 'stock']
+        root = self.root
+        self.patch('runbot.build', 'path', lambda build, *l: os.path.join(
+            root, 'build%d' % build.id, *l))
+        self.patch('runbot.build', 'server', lambda build, *l: build.path(
+            'openerp', *l))
+        self.patch('runbot.build', 'get_modules_to_check_pylint',
+                   lambda build: list(self.modules))
+        self.patch('runbot.build', 'spawn', lambda build, *args, **kwargs:
+                   self.spawned.append((args, kwargs)))
+        self.build = self.env['runbot.build'].create({
+            'branch_id': self.branch.id,
+            'name': 'a' * 40,
+        })
+        self.build_dir = self.build.path()
+        self.addons = self.build.server('addons')
+        os.makedirs(self.addons)
+        with open(os.path.join(self.build_dir, '.pylintrc'), 'w') as f_conf:
+            f_conf.write('[MASTER]\n')
+
+    def patch(self, model, name, method):
+        """Replace a method of a model for the test"""
+        cls = type(self.env[model])
+        if name in vars(cls):
+            self.addCleanup(setattr, cls, name, vars(cls)[name])
+        else:
+            self.addCleanup(delattr, cls, name)
+        setattr(cls, name, method)
+
+    def run_job(self):
+        """Run job_15_pylint then the script it spawned
+        :return str: output of the script, the log of the job
+        """
+        self.registry('runbot.build').job_15_pylint(
+            self.cr, self.uid, self.build, 'lock', 'log')
+        self.assertEqual(len(self.spawned), 1)
+        (cmd, lock_path, log_path), kwargs = self.spawned[0]
+        self.assertEqual((lock_path, log_path), ('lock', 'log'))
+        self.assertEqual(kwargs, {'cpu_limit': 2100})
+        env = dict(os.environ,
+                   PATH=self.bin_dir + os.pathsep + os.environ['PATH'])
+        return subprocess.check_output(cmd, env=env)
+
+    def read_log(self, module, ext, build=None):
+        with open((build or self.build).path(
+                'logs', 'pylint', module + ext)) as f_log:
+            return f_log.read()
+
+    def write_log(self, build, module, ext, content):
+        log_dir = build.path('logs', 'pylint')
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        with open(os.path.join(log_dir, module + ext), 'w') as f_log:
+            f_log.write(content)
+
+
+class TestPylintParallel(PylintBuildCase):
+
+    def test_parallel(self):
+        """Each module is checked by its own pylint, logging in its log,
+        then the logs are merged in the order of the modules"""
+        self.modules = ['stock', 'sale', 'account']
+        output = self.run_job()
+        conf = os.path.join(self.build_dir, '.pylintrc')
+        for module in self.modules:
+            self.assertEqual(
+                self.read_log(module, '.txt'),
+                '--rcfile=%s %s\n' % (conf, os.path.join(self.addons,
+                                                        module)))
+            self.assertEqual(self.read_log(module, '.status'), '16\n')
+        self.assertEqual(output, ''.join(
+            self.read_log(module, '.txt') for module in self.modules))
+        with open(os.path.join(self.build_dir,
+                               'pylint_run.sh')) as f_script:
+            self.assertIn('xargs -P 3 ', f_script.read())
+
+    def test_no_module(self):
+        self.modules = []
+        self.registry('runbot.build').job_15_pylint(
+            self.cr, self.uid, self.build, 'lock', 'log')
+        self.assertFalse(self.spawned)
+
+
+class TestPylintSingle(PylintBuildCase):
+
+    def setUp(self):
+        super(TestPylintSingle, self).setUp()
+        self.repo.pylint_run_mode = 'single'
+
+    def test_single(self):
+        """All modules are checked by one pylint logging in the job log"""
+        output = self.run_job()
+        self.assertEqual(output, '--rcfile=%s %s %s\n' % (
+            os.path.join(self.build_dir, '.pylintrc'),
+            os.path.join(self.addons, 'sale'),
+            os.path.join(self.addons, 'stock')))
+        self.assertFalse(os.listdir(
+            os.path.join(self.build_dir, 'logs', 'pylint')))
+
+
+class TestGetPathModule(unittest2.TestCase):
+
+    def test_get_path_module(self):
+        self.assertEqual(get_path_module('sale/models/sale.py'), 'sale')
+        self.assertEqual(get_path_module('sale/__openerp__.py'), 'sale')
+        self.assertEqual(get_path_module('addons/sale/sale.py'), 'sale')
+        self.assertEqual(
+            get_path_module('openerp/addons/base/res/res_partner.py'),
+            'base')
+        self.assertIsNone(get_path_module('README.md'))
+        self.assertIsNone(get_path_module('addons/README.md'))
+
+
+class TestGetPylintStatus(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestGetPylintStatus, self).setUp()
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+
+    def write_log(self, module, ext, content):
+        with open(os.path.join(self.log_dir, module + ext), 'w') as f_log:
+            f_log.write(content)
+
+    def test_get_pylint_status(self):
+        self.write_log('sale', '.txt', 'W0611 unused import\n')
+        self.write_log('sale', '.status', '4\n')
+        self.assertEqual(get_pylint_status(self.log_dir, 'sale'), 4)
+
+    def test_unfinished(self):
+        """Without both a log and a valid status pylint didn't finish"""
+        self.write_log('sale', '.txt', '')
+        self.assertIsNone(get_pylint_status(self.log_dir, 'sale'))
+        self.write_log('sale', '.status', '')
+        self.assertIsNone(get_pylint_status(self.log_dir, 'sale'))
+        self.write_log('stock', '.status', '0')
+        self.assertIsNone(get_pylint_status(self.log_dir, 'stock'))
+
+
+class TestPylintBaseline(PylintBuildCase):
+
+    def setUp(self):
+        super(TestPylintBaseline, self).setUp()
+        self.distances = {}
+        self.changed_paths = ['sale/models/sale.py', 'README.md']
+        self.module_lists = {self.repo.id: ['sale', 'stock', 'account']}
+        self.patch('runbot.repo', 'get_merge_base_distance',
+                   lambda repo, treeish_from, treeish_to:
+                   self.distances.get(treeish_from))
+        self.patch('runbot.repo', 'get_changed_paths',
+                   lambda repo, treeish_from, treeish_to:
+                   list(self.changed_paths))
+        self.patch('runbot.repo', 'get_module_list',
+                   lambda repo, treeish: list(self.module_lists[repo.id]))
+
+    def make_target(self, branch_name, sha, distance, result='ok'):
+        """Create a finished build of a sticky branch with pylint logs"""
+        branch = self.env['runbot.branch'].search([
+            ('repo_id', '=', self.repo.id),
+            ('name', '=', branch_name),
+        ]) or self.env['runbot.branch'].create({
+            'repo_id': self.repo.id,
+            'name': branch_name,
+            'sticky': True,
+        })
+        target = self.env['runbot.build'].create({
+            'branch_id': branch.id,
+            'name': sha,
+            'state': 'done',
+            'result': result,
+        })
+        os.makedirs(target.path('logs', 'pylint'))
+        self.distances[sha] = distance
+        return target
+
+    def test_closest_baseline(self):
+        """The baseline is the last build of the closest sticky branch,
+        whose results are reusable for the modules not changed"""
+        self.make_target('refs/heads/8.0', 'b' * 40, 5)
+        target = self.make_target('refs/heads/9.0', 'c' * 40, 2)
+        # Only the last build of a branch may be a baseline, unless it
+        # was killed, and never without pylint logs
+        self.make_target('refs/heads/9.0', 'd' * 40, 1, result='killed')
+        self.make_target('refs/heads/10.0', 'e' * 40, 3)
+        last = self.env['runbot.build'].create({
+            'branch_id': self.env['runbot.branch'].search([
+                ('repo_id', '=', self.repo.id),
+                ('name', '=', 'refs/heads/10.0'),
+            ]).id,
+            'name': 'f' * 40,
+            'state': 'done',
+            'result': 'ok',
+        })
+        self.distances[last.name] = 1
+        self.assertEqual(self.build.get_pylint_baseline(),
+                         (target, set(['stock', 'account'])))
+
+    def test_no_baseline(self):
+        self.make_target('refs/heads/8.0', 'b' * 40, None)
+        self.assertEqual(self.build.get_pylint_baseline(), (None, None))
+        # Builds of sticky branches are checked from scratch
+        self.branch.sticky = True
+        self.distances['b' * 40] = 1
+        self.assertEqual(self.build.get_pylint_baseline(), (None, None))
+
+    def test_conf_changed(self):
+        """No result is reused once the pylint configuration changed"""
+        self.make_target('refs/heads/8.0', 'b' * 40, 1)
+        self.changed_paths.append('.pylintrc')
+        self.assertEqual(self.build.get_pylint_baseline(), (None, None))
+
+    def test_dependency_modules(self):
+        """Modules of dependency repos are never reused"""
+        target = self.make_target('refs/heads/8.0', 'b' * 40, 1)
+        dependency = self.env['runbot.repo'].create({
+            'name': 'localhost:1/bench/addons',
+            'check_pylint': True,
+        })
+        self.module_lists[dependency.id] = ['account', 'crm']
+        self.patch('runbot.build', 'get_repo_branch_name',
+                   lambda build: {build.repo_id.id: build.name,
+                                  dependency.id: 'refs/heads/8.0'})
+        self.assertEqual(self.build.get_pylint_baseline(),
+                         (target, set(['stock'])))
+
+    def test_incremental_job(self):
+        """Only finished results of the baseline are reused"""
+        self.repo.pylint_incremental = True
+        baseline = self.make_target('refs/heads/8.0', 'b' * 40, 1)
+        self.write_log(baseline, 'sale', '.txt', 'sale baseline\n')
+        self.write_log(baseline, 'sale', '.status', '0\n')
+        self.write_log(baseline, 'stock', '.txt', 'stock baseline\n')
+        self.patch('runbot.build', 'get_pylint_baseline',
+                   lambda build: (baseline, set(['sale', 'stock'])))
+        output = self.run_job()
+        self.assertEqual(self.read_log('sale', '.txt'), 'sale baseline\n')
+        self.assertEqual(self.read_log('sale', '.status'), '0\n')
+        self.assertEqual(self.read_log('stock', '.status'), '16\n')
+        self.assertEqual(output, 'sale baseline\n' +
+                         self.read_log('stock', '.txt'))
+
+
+class TestCleanPylintCache(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestCleanPylintCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.marker = os.path.join(self.cache_dir,
+                                   runbot_build.PYLINT_CACHE_CLEAN_MARKER)
+
+    def write_entry(self, key, size, age):
+        """Write a result of the cache last used age seconds ago"""
+        path = get_pylint_cache_path(self.cache_dir, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f_entry:
+            f_entry.write('x' * size)
+        used = time.time() - age
+        os.utime(path, (used, used))
+        return path
+
+    def test_clean(self):
+        """The least recently used results are removed first"""
+        old = self.write_entry('a1', 300, 30)
+        middle = self.write_entry('a2', 300, 20)
+        new = self.write_entry('b1', 300, 10)
+        self.assertTrue(clean_pylint_cache(self.cache_dir, 700))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(middle))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(self.marker))
+
+    def test_throttled(self):
+        """The cache is swept once by interval, whatever its size"""
+        self.assertTrue(clean_pylint_cache(self.cache_dir, 0))
+        entry = self.write_entry('a1', 300, 10)
+        self.assertFalse(clean_pylint_cache(self.cache_dir, 0))
+        self.assertTrue(os.path.exists(entry))
+        last_clean = time.time() - runbot_build.PYLINT_CACHE_CLEAN_INTERVAL
+        os.utime(self.marker, (last_clean, last_clean))
+        self.assertTrue(clean_pylint_cache(self.cache_dir, 0))
+        self.assertFalse(os.path.exists(entry))
+        # The marker is never evicted
+        self.assertTrue(os.path.exists(self.marker))
+
+
+class TestPylintCache(PylintBuildCase):
+
+    def setUp(self):
+        super(TestPylintCache, self).setUp()
+        self.env['ir.config_parameter'].set_param(
+            'runbot_pylint.cache_size', '1')
+        root = self.root
+        self.patch('runbot.repo', 'root', lambda repo: root)
+        self.cache_dir = os.path.join(self.root, 'pylint_cache')
+        self.keys = {'sale': '1a' * 20, 'stock': '2b' * 20}
+
+    def write_cache_keys(self, cache_keys):
+        self.write_log(self.build, 'cache_keys', '.json',
+                       json.dumps(cache_keys))
+
+    def read_cache(self, key, ext):
+        path = get_pylint_cache_path(self.cache_dir, key)
+        with open(path[:-len('.txt')] + ext) as f_entry:
+            return f_entry.read()
+
+    def test_store(self):
+        """Only results of pylint runs which finished are stored"""
+        self.assertEqual(self.build.get_pylint_cache_dir(), self.cache_dir)
+        self.write_log(self.build, 'sale', '.txt', 'sale log\n')
+        self.write_log(self.build, 'sale', '.status', '0\n')
+        self.write_log(self.build, 'stock', '.txt', 'stock log\n')
+        self.write_log(self.build, 'stock', '.status', '32\n')
+        self.write_log(self.build, 'account', '.txt', '')
+        self.keys['account'] = '3c' * 20
+        self.write_cache_keys(self.keys)
+        self.build.store_pylint_cache()
+        self.assertEqual(self.read_cache(self.keys['sale'], '.txt'),
+                         'sale log\n')
+        self.assertEqual(self.read_cache(self.keys['sale'], '.status'),
+                         '0\n')
+        for module in ('stock', 'account'):
+            self.assertFalse(os.path.exists(get_pylint_cache_path(
+                self.cache_dir, self.keys[module])))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(
+            get_pylint_cache_path(self.cache_dir, self.keys['sale'])))),
+            [self.keys['sale'] + '.status', self.keys['sale'] + '.txt'])
+
+    def test_invalid_cache_keys(self):
+        self.write_log(self.build, 'cache_keys', '.json', '{')
+        self.build.store_pylint_cache()
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_disabled(self):
+        self.env['ir.config_parameter'].set_param(
+            'runbot_pylint.cache_size', '0')
+        self.assertIsNone(self.build.get_pylint_cache_dir())
+
+    def test_cached_job(self):
+        """Cached results are replayed, the others stored once checked"""
+        os.makedirs(os.path.join(self.cache_dir, self.keys['sale'][:2]))
+        cache_path = get_pylint_cache_path(self.cache_dir, self.keys['sale'])
+        with open(cache_path, 'w') as f_entry:
+            f_entry.write('sale cached\n')
+        with open(cache_path[:-len('.txt')] + '.status', 'w') as f_entry:
+            f_entry.write('0\n')
+        self.patch('runbot.build', 'get_pylint_cache_keys',
+                   lambda build, modules, path_pylint_conf: dict(
+                       (module, self.keys[module]) for module in modules))
+        output = self.run_job()
+        self.assertEqual(self.read_log('sale', '.txt'), 'sale cached\n')
+        self.assertEqual(output, 'sale cached\n' +
+                         self.read_log('stock', '.txt'))
+        self.assertEqual(json.loads(self.read_log('cache_keys', '.json')),
+                         {'stock': self.keys['stock']})
+        self.build.store_pylint_cache()
+        self.assertEqual(self.read_cache(self.keys['stock'], '.txt'),
+                         self.read_log('stock', '.txt'))
+        self.assertEqual(self.read_cache(self.keys['stock'], '.status'),
+                         '16\n')
+
+
+class TestGetDepends(unittest2.TestCase):
+
+    def setUp(self):
+        super(TestGetDepends, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        runbot_build._manifest_depends.clear()
+        self.addons = os.path.join(self.root, 'addons')
+        self.other_addons = os.path.join(self.root, 'other_addons')
+        self.make_module(self.addons, 'sale', ['account', 'stock'])
+        self.make_module(self.addons, 'account', ['base'])
+        self.make_module(self.addons, 'stock', ['product'])
+        self.make_module(self.other_addons, 'product', ['base'])
+        # Shadowed by the module of the first addons path
+        self.make_module(self.other_addons, 'stock', ['mrp'])
+
+    def make_module(self, addons_path, module, depends):
+        if not os.path.isdir(os.path.join(addons_path, module)):
+            os.makedirs(os.path.join(addons_path, module))
+        with open(os.path.join(addons_path, module, '__openerp__.py'),
+                  'w') as f_manifest:
+            f_manifest.write(repr({'name': module, 'depends': depends}))
+
+    def test_get_depends(self):
+        addons_paths = '%s, %s' % (self.addons, self.other_addons)
+        self.assertEqual(
+            get_depends('sale', addons_paths),
+            set(['sale', 'account', 'stock', 'product', 'base']))
+        self.assertEqual(get_depends('product, account', addons_paths),
+                         set(['product', 'account', 'base']))
+
+    def test_missing_module(self):
+        """Modules which aren't found are kept without their depends"""
+        self.assertEqual(get_depends('stock,unknown', self.addons),
+                         set(['stock', 'product', 'unknown']))
+
+    def test_duplicated_addons_paths(self):
+        addons_paths = ','.join(
+            [self.other_addons, self.addons, self.other_addons])
+        self.assertEqual(get_depends('stock', addons_paths),
+                         set(['stock', 'mrp']))
+
+    def test_manifest_cache(self):
+        """Manifests are parsed once by content, never kept once changed"""
+        self.make_module(self.other_addons, 'account', ['base'])
+        addons_paths = '%s,%s' % (self.addons, self.other_addons)
+        get_depends('account', addons_paths)
+        get_depends('account', ','.join(
+            [self.other_addons, self.addons]))
+        self.assertEqual(len(runbot_build._manifest_depends), 1)
+        self.make_module(self.addons, 'account', ['mail'])
+        self.assertEqual(get_depends('account', addons_paths),
+                         set(['account', 'mail']))
+